@@ -1,25 +1,64 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import itertools
 import logging
 from typing import Any, Dict, List, Text, Optional
 import json
+import os
 from collections import defaultdict
 
-from aiohttp import ClientSession
-
-from nltk.stem import SnowballStemmer
-
+from aiohttp import ClientResponseError
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import (
     EventType, SlotSet
 )
 
+from .bfz_client import REQUEST_TIMEOUT, BackendUnavailable, bfz_client
+from .circuit_breaker import CLOSED
+from .lexicon import load_lexicon
+from .metrics import (
+    FILTERS_PER_REQUEST, RELAXED_SEARCHES, SYNONYM_RESOLUTIONS, UNRESOLVED_ENTITIES, registry, timed_action
+)
+from .result_cache import result_cache
+from .single_flight import SingleFlight
+from .tag_index import tag_index
+
 logger = logging.getLogger(__name__)
 
-FILTER_MAPPING_PATH = 'data/generated/filter_questions/entities/filter_mapping.csv'
-FILTER_SYNONYMS_PATH = 'data/generated/filter_questions/entities/filter_synonyms.csv'
 BFZ_URL = ''
-BFZ_API_URL = 'https://api.beratungsnetz-migration.de'
+BFZ_API_URL = os.environ.get('BFZ_API_URL', 'https://api.beratungsnetz-migration.de')
+
+# Count results while the backend response streams in rather than parsing the whole list,
+# optionally stopping at a number of results (run only needs to know whether there is any)
+BFZ_STREAM_COUNT = os.environ.get('BFZ_STREAM_COUNT', '1') != '0'
+BFZ_COUNT_LIMIT = int(os.environ.get('BFZ_COUNT_LIMIT', 0)) or None
+
+# Reply when the number of results can't be retrieved in time, the results page might still work
+BACKEND_UNAVAILABLE_TEXT = ('Ich kann die Anzahl der Angebote gerade leider nicht abrufen.\n\n'
+                            '[Hier klicken]({results_url}) um die Ergebnisse im Bfz anzuzeigen.')
+
+# When a request has no results, its subsets of filters are searched for results, the ones keeping the
+# most filters first. Counts are requested concurrently and the search stops once the budget is used up,
+# the budget is kept above the timeout of a request so that requests are not routinely cancelled
+BFZ_RELAXATION_CONCURRENCY = int(os.environ.get('BFZ_RELAXATION_CONCURRENCY', 4))
+BFZ_RELAXATION_BUDGET = float(os.environ.get('BFZ_RELAXATION_BUDGET', REQUEST_TIMEOUT + 0.5))
+if 0 < BFZ_RELAXATION_BUDGET <= REQUEST_TIMEOUT:
+    logger.warning(f'BFZ_RELAXATION_BUDGET is raised to {REQUEST_TIMEOUT + 0.5}s, above BFZ_REQUEST_TIMEOUT')
+    BFZ_RELAXATION_BUDGET = REQUEST_TIMEOUT + 0.5
+BFZ_RELAXATION_MAX_QUERIES = int(os.environ.get('BFZ_RELAXATION_MAX_QUERIES', 32))
+RELAXED_RESULTS_MAX = 3
+
+RELAXED_RESULTS_TEXT = 'Mit weniger Filtern habe ich diese Angebote gefunden:\n\n{results}'
+RELAXED_RESULT_TEXT = '* [{filters}]({results_url}): {num_documents} Angebote'
+
+# Identical backend requests issued concurrently by different conversations share one call
+backend_requests = SingleFlight()
+
+registry.register_stats('bfz_client', bfz_client.stats)
+registry.register_stats('result_cache', result_cache.stats)
+registry.register_stats('backend_coalescing', backend_requests.stats)
+registry.register_stats('tag_index', tag_index.stats)
 
 
 class ActionFilterResults(Action):
@@ -29,18 +68,7 @@ class ActionFilterResults(Action):
         return "action_filter_results"
 
     def __init__(self):
-        import pandas as pd
-
-        df = pd.read_csv(FILTER_MAPPING_PATH)
-        df = df.set_index('filter')
-        self.filter_mapping = df.to_dict()
-        self.filters = self.filter_mapping['display'].keys()
-
-        df = pd.read_csv(FILTER_SYNONYMS_PATH)
-        df = df.set_index('synonym')
-        self.synonym_to_filter = df.to_dict()['filter']
-
-        self.stemmer = SnowballStemmer('german')
+        self.lexicon = load_lexicon()
 
 
     def _format(self, filters):
@@ -57,11 +85,11 @@ class ActionFilterResults(Action):
     # TODO:
     #  - Extract text into top of the file for ease of maintenance
     def _template_filters(self, filters):
-        display_filters = [self.filter_mapping['display'][filter] for filter in filters]
+        display_filters = [self.lexicon[filter].display for filter in filters]
         d_filters = defaultdict(list)
 
         for filter in filters:
-            d_filters[self.filter_mapping['context'][filter]] += [self.filter_mapping['display'][filter]]
+            d_filters[self.lexicon[filter].context] += [self.lexicon[filter].display]
 
         if {'_topic', '_targetgroup', '_language', '_searchterms'} >= set(d_filters.keys()):
 
@@ -87,7 +115,7 @@ class ActionFilterResults(Action):
 
 
     def _bfz_url(self, filters):
-        key_filters = [(self.filter_mapping['filter_category'][filter], filter) for filter in filters]
+        key_filters = [(self.lexicon[filter].category, filter) for filter in filters]
         keys = set([k for k, _ in key_filters])
 
         # The special case where two filters share the same key, they have to be concatenated with dash
@@ -100,36 +128,158 @@ class ActionFilterResults(Action):
         return f'{BFZ_URL}/list{url_filters}'
 
 
-    # TODO:
-    #   - Handle exceptions in request
+    def _query(self, filters):
+        """Canonical form of a filter request: the sorted tag filters and the search term"""
+        filters = sorted(set(filters))
+        search_filters = [f for f in filters if self.lexicon[f].is_search_term]
+        tag_filters = tuple(f for f in filters if not self.lexicon[f].is_search_term)
+        return tag_filters, (search_filters[0] if search_filters else None)
+
+
+    def _bfz_api_url(self, query):
+        tag_filters, search_term = query
+
+        if search_term:
+            search_param = f'&search={search_term}'
+        else:
+            search_param = ''
+
+        if tag_filters:
+            tag_param = ('tag' if len(tag_filters)==1 else 'tags')
+            tag_param = f'&{tag_param}={",".join(tag_filters)}'
+        else:
+            tag_param = ''
+
+        return f'{BFZ_API_URL}/actions/exportItems?format=JSON&keys=id{tag_param}{search_param}'
+
+
     async def _num_bfz_documents(self, filters):
-        async with ClientSession() as session:
+        query = self._query(filters)
 
-            search_filters = [f for f in filters if self.filter_mapping['is_search_term'][f]]
-            filters = [f for f in filters if not self.filter_mapping['is_search_term'][f]]
+        # Answer locally while the tag index is fresh
+        num_documents = tag_index.count(query)
+        if num_documents is not None:
+            logger.info(f'Counted {num_documents} results for {query} in the local tag index')
+            return num_documents
 
-            if search_filters:
-                search_param = f'&search={search_filters[0]}'
-            else:
-                search_param = ''
+        return await result_cache.get_or_fetch(query, lambda: self._fetch_num_bfz_documents(query))
 
-            if filters:
-                tag_param = ('tag' if len(filters)==1 else 'tags')
-                tag_param = f'&{tag_param}={",".join(filters)}'
-            else:
-                tag_param = ''
 
-            url = f'{BFZ_API_URL}/actions/exportItems?format=JSON&keys=id{tag_param}{search_param}'
+    async def _fetch_num_bfz_documents(self, query):
+        url = self._bfz_api_url(query)
 
-            resp = await session.request(method="GET", url=url)
-            resp.raise_for_status()
-            res = await resp.text()
+        # The shared client keeps connections to the backend alive between turns
+        if BFZ_STREAM_COUNT:
+            num_documents = await backend_requests.do(url, lambda: bfz_client.count_items(url, BFZ_COUNT_LIMIT))
+        else:
+            res = await backend_requests.do(url, lambda: bfz_client.get_text(url))
             num_documents = len(json.loads(res))
-            logger.info(f'Issued backend request to {url} with {num_documents} results')
+        logger.info(f'Issued backend request to {url} with {num_documents} results')
         return num_documents
 
+    async def _count_many(self, filter_sets, timeout):
+        """Numbers of results of the filter sets, None for the ones not counted within `timeout` seconds
+
+        At most BFZ_RELAXATION_CONCURRENCY counts are requested at once, over the connections of the
+        shared client. Requests still outstanding when the time is up are cancelled.
+        """
+        semaphore = asyncio.Semaphore(BFZ_RELAXATION_CONCURRENCY)
+
+        async def count(filters):
+            async with semaphore:
+                # While the breaker is not closed the request could be its trial, which must not be cancelled
+                if bfz_client.breaker.state != CLOSED:
+                    return None
+                return await self._num_bfz_documents(filters)
+
+        tasks = [asyncio.ensure_future(count(filters)) for filters in filter_sets]
+        if not tasks:
+            return []
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        counts = []
+        for filters, task in zip(filter_sets, tasks):
+            if task.cancelled():
+                counts.append(None)
+            elif task.exception() is not None:
+                logger.warning(f'Could not count the results of {filters}, {task.exception()}')
+                counts.append(None)
+            else:
+                counts.append(task.result())
+        return counts
+
+
+    async def _relaxed_results(self, filters):
+        """Subsets of `filters` with results keeping as many filters as possible, with their number of results"""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + BFZ_RELAXATION_BUDGET
+        queries = BFZ_RELAXATION_MAX_QUERIES
+        complete = True
+
+        for size in range(len(filters) - 1, 0, -1):
+            subsets = list(itertools.islice(itertools.combinations(sorted(filters), size), queries))
+            remaining = deadline - loop.time()
+            if not subsets or remaining <= 0:
+                complete = False
+                break
+
+            counts = await self._count_many(subsets, remaining)
+            queries -= len(subsets)
+            complete = complete and None not in counts
+
+            found = sorted([(subset, count) for subset, count in zip(subsets, counts) if count],
+                           key=lambda result: -result[1])
+            if found:
+                RELAXED_SEARCHES.inc('found')
+                return found[:RELAXED_RESULTS_MAX]
+            if all(count is None for count in counts):
+                # The backend is unavailable, smaller subsets wouldn't be counted either
+                break
+
+        RELAXED_SEARCHES.inc('not_found' if complete else 'incomplete')
+        return []
+
+
+    def _template_relaxed_results(self, results):
+        def count(num_documents):
+            # Counting stopped at the limit, there might be more
+            return f'{num_documents}+' if BFZ_COUNT_LIMIT and num_documents >= BFZ_COUNT_LIMIT else num_documents
+
+        results = [RELAXED_RESULT_TEXT.format(filters=', '.join(self.lexicon[f].display for f in subset),
+                                              results_url=self._bfz_url(subset),
+                                              num_documents=count(num_documents))
+                   for subset, num_documents in results]
+        return RELAXED_RESULTS_TEXT.format(results='\n'.join(results))
+
+
+    def _resolve_filters(self, raw_filters):
+        filters = []
+        for f in raw_filters:
+            if f in self.lexicon:
+                filters.append(f)
+            else:
+                # This filter was picked up as an entity but not synonym resolved, let's try a custom resolution
+                resolved = self.lexicon.resolve(f)
+                if resolved:
+                    logger.info(f'Resolving synonym {f} to {resolved}')
+                    SYNONYM_RESOLUTIONS.inc()
+                    filters.append(resolved)
+                else:
+                    UNRESOLVED_ENTITIES.inc()
+
+        # Deduplicate filters
+        return list(set(filters))
+
+
     # TODO:
     #   - Extract text into top of the file for ease of maintenance
+    @timed_action
     async def run(
             self,
             dispatcher: CollectingDispatcher,
@@ -137,20 +287,8 @@ class ActionFilterResults(Action):
             domain: Dict[Text, Any],
     ) -> List[EventType]:
         raw_filters = list(tracker.get_latest_entity_values("filter"))
-
-        filters = []
-        for f in raw_filters:
-            if f in self.filters:
-                filters.append(f)
-            else:
-                # This filter was picked up as an entity but not synonym resolved, let's try a custom resolution
-                stemmed = self.stemmer.stem(f)
-                if stemmed in self.synonym_to_filter:
-                    logger.info(f'Resolving synonym {f} to {self.synonym_to_filter[stemmed]}')
-                    filters.append(self.synonym_to_filter[stemmed])
-
-        # Deduplicate filters
-        filters = list(set(filters))
+        filters = self._resolve_filters(raw_filters)
+        FILTERS_PER_REQUEST.observe(len(filters))
 
         if not filters:
             dispatcher.utter_message(template='utter_keywords_not_understood', keywords=self._format(raw_filters))
@@ -158,7 +296,14 @@ class ActionFilterResults(Action):
         else:
             dispatcher.utter_message(text=self._template_filters(filters))
 
-            num_documents = await self._num_bfz_documents(filters)
+            try:
+                num_documents = await self._num_bfz_documents(filters)
+            except (BackendUnavailable, ClientResponseError) as e:
+                # The backend is down or rejected the request (4xx), the results page might still work
+                logger.warning(f'Replying without the number of results, {e!r}')
+                dispatcher.utter_message(text=BACKEND_UNAVAILABLE_TEXT.format(results_url=self._bfz_url(filters)))
+                return [SlotSet('action_filter_error', None)]
+
             if num_documents:
                 dispatcher.utter_message(template='utter_results_found', results_url=self._bfz_url(filters))
                 action_filter_error = None
@@ -167,6 +312,11 @@ class ActionFilterResults(Action):
                 dispatcher.utter_message(template='utter_no_results_found')
                 action_filter_error = 'no_results_found'
 
+                if len(filters) > 1 and BFZ_RELAXATION_BUDGET > 0:
+                    relaxed = await self._relaxed_results(filters)
+                    if relaxed:
+                        dispatcher.utter_message(text=self._template_relaxed_results(relaxed))
+
         return [SlotSet('action_filter_error', action_filter_error)]
 
 
@@ -178,6 +328,7 @@ class ResetActionFilterError(Action):
         return 'reset_action_filter_error'
 
 
+    @timed_action
     async def run(
             self,
             dispatcher: CollectingDispatcher,
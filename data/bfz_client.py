@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Text
+
+from aiohttp import ClientError, ClientResponseError, ClientSession, TCPConnector, TraceConfig
+
+from .circuit_breaker import CLOSED, CircuitBreaker
+from .metrics import BACKEND_LATENCY, BACKEND_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings, they can be tuned per deployment through the environment
+POOL_SIZE = int(os.environ.get('BFZ_POOL_SIZE', 20))
+KEEPALIVE_TIMEOUT = float(os.environ.get('BFZ_KEEPALIVE_TIMEOUT', 30))
+DNS_CACHE_TTL = int(os.environ.get('BFZ_DNS_CACHE_TTL', 300))
+
+# Latency budget of a request: each attempt has its own deadline and attempts are retried
+# while the overall budget allows it
+REQUEST_TIMEOUT = float(os.environ.get('BFZ_REQUEST_TIMEOUT', 2))
+REQUEST_BUDGET = float(os.environ.get('BFZ_REQUEST_BUDGET', 4))
+MAX_ATTEMPTS = int(os.environ.get('BFZ_MAX_ATTEMPTS', 2))
+
+# The circuit breaker opens after a number of consecutive failures and stays open a number of seconds
+BREAKER_THRESHOLD = int(os.environ.get('BFZ_BREAKER_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BFZ_BREAKER_RESET_TIMEOUT', 30))
+
+# Tokens relevant to count array elements: complete strings, structural characters and quotes
+# opening a string that continues in the next chunk
+JSON_TOKENS = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{},"]', re.S)
+JSON_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*', re.S)
+
+
+class JsonArrayCounter:
+    """Counts the elements of a top level JSON array fed chunk by chunk
+
+    Elements are counted from the commas at the top level, only the nesting depth and the string
+    state are kept between chunks, so memory does not depend on the size of the array.
+    The input is assumed to be valid JSON.
+    """
+
+    def __init__(self):
+        self._separators = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._waiting_first = False
+        self._non_empty = False
+
+    @property
+    def count(self) -> int:
+        return self._separators + self._non_empty
+
+    def _skip_string(self, chunk: bytes, pos: int) -> int:
+        """Position after the end of the string continuing at `pos`, -1 if it continues in the next chunk"""
+        if self._escape:
+            if pos >= len(chunk):
+                return -1
+            pos += 1
+            self._escape = False
+        end = JSON_STRING_BODY.match(chunk, pos).end()
+        if end < len(chunk) and chunk[end:end+1] == b'"':
+            self._in_string = False
+            return end + 1
+        # Either the chunk ends inside the string or in the middle of an escape sequence
+        self._escape = end < len(chunk)
+        return -1
+
+    def feed(self, chunk: bytes) -> int:
+        pos = 0
+        if self._in_string:
+            pos = self._skip_string(chunk, pos)
+            if pos < 0:
+                return self.count
+            self._non_empty = self._non_empty or self._depth >= 1
+
+        for match in JSON_TOKENS.finditer(chunk, pos):
+            token = match.group()
+
+            if self._waiting_first:
+                # Elements that are numbers or literals produce no token, look at the gap instead
+                if token != b']' or chunk[pos:match.start()].strip():
+                    self._non_empty = True
+                self._waiting_first = False
+
+            if token == b'"':
+                # A string continuing in the next chunk, complete strings are matched as one token
+                self._in_string = True
+                self._skip_string(chunk, match.end())
+                return self.count
+            elif token == b'[' or token == b'{':
+                self._depth += 1
+                if self._depth == 1 and token == b'[':
+                    self._waiting_first = True
+                    pos = match.end()
+            elif token == b']' or token == b'}':
+                self._depth -= 1
+            elif token == b',' and self._depth == 1:
+                self._separators += 1
+
+        if self._waiting_first and chunk[pos:].strip():
+            self._non_empty = True
+            self._waiting_first = False
+
+        return self.count
+
+
+class BackendUnavailable(Exception):
+    """The Beratungsnetz API could not answer within the latency budget, or the circuit breaker is open"""
+
+
+class BfzClient:
+    """Long lived HTTP client for the Beratungsnetz API
+
+    One session (and therefore one connection pool) is shared by all the requests issued
+    from the action server process, so that connections, DNS lookups and TLS handshakes
+    are reused across conversation turns. The session is created lazily on the running
+    event loop.
+    """
+
+    def __init__(self,
+                 pool_size: int = POOL_SIZE,
+                 keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+                 dns_cache_ttl: int = DNS_CACHE_TTL,
+                 request_timeout: float = REQUEST_TIMEOUT,
+                 request_budget: float = REQUEST_BUDGET,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.request_timeout = request_timeout
+        self.request_budget = request_budget
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+        self._session: Optional[ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._counters = Counter()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    def _trace_config(self) -> TraceConfig:
+        trace = TraceConfig()
+
+        def count(name):
+            async def on_event(session, context, params):
+                self._counters[name] += 1
+            return on_event
+
+        trace.on_connection_create_end.append(count('connections_created'))
+        trace.on_connection_reuseconn.append(count('connections_reused'))
+        trace.on_connection_queued_start.append(count('connections_queued'))
+        trace.on_dns_cache_hit.append(count('dns_cache_hits'))
+        trace.on_dns_cache_miss.append(count('dns_cache_misses'))
+        return trace
+
+    def session(self) -> ClientSession:
+        loop = asyncio.get_event_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = TCPConnector(limit=self.pool_size,
+                                     keepalive_timeout=self.keepalive_timeout,
+                                     use_dns_cache=True,
+                                     ttl_dns_cache=self.dns_cache_ttl)
+            self._session = ClientSession(connector=connector,
+                                          headers={'Accept-Encoding': 'gzip, deflate'},
+                                          trace_configs=[self._trace_config()])
+            self._loop = loop
+            logger.info(f'Opened Beratungsnetz API session with a pool of {self.pool_size} connections')
+        return self._session
+
+    @contextmanager
+    def _track(self):
+        self._counters['requests'] += 1
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    async def _with_deadline(self, request: Callable[[], Awaitable[Any]]) -> Any:
+        """Issues `request` with a deadline per attempt, retrying failed attempts within the budget"""
+        if not self.breaker.allow():
+            self._counters['short_circuited'] += 1
+            raise BackendUnavailable('Circuit breaker is open')
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.request_budget
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(request(), min(self.request_timeout, deadline - loop.time()))
+            except asyncio.TimeoutError as e:
+                self._counters['timeouts'] += 1
+                BACKEND_RESPONSES.inc('timeout')
+                error = e
+            except ClientResponseError as e:
+                # Client errors are not going to be solved by retrying and do not mean the backend is down
+                if e.status < 500:
+                    self.breaker.record_success()
+                    raise
+                error = e
+            except ClientError as e:
+                BACKEND_RESPONSES.inc('error')
+                error = e
+            except asyncio.CancelledError:
+                # Cancelled by the caller, the outcome of the attempt is unknown
+                self.breaker.record_abort()
+                raise
+            except Exception:
+                self._counters['failures'] += 1
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                BACKEND_LATENCY.observe(time.perf_counter() - start)
+
+            self._counters['failures'] += 1
+            self.breaker.record_failure()
+            if attempt >= self.max_attempts or deadline - loop.time() <= 0 or not self.breaker.allow():
+                raise BackendUnavailable(f'Request failed after {attempt} attempts: {error!r}') from error
+            self._counters['retries'] += 1
+
+    async def _get_text(self, url: Text) -> Text:
+        with self._track():
+            async with self.session().get(url) as resp:
+                BACKEND_RESPONSES.inc(str(resp.status))
+                resp.raise_for_status()
+                return await resp.text()
+
+    async def get_text(self, url: Text) -> Text:
+        return await self._with_deadline(lambda: self._get_text(url))
+
+    async def _count_items(self, url: Text, limit: Optional[int] = None) -> int:
+        with self._track():
+            async with self.session().get(url) as resp:
+                BACKEND_RESPONSES.inc(str(resp.status))
+                resp.raise_for_status()
+                counter = JsonArrayCounter()
+                async for chunk in resp.content.iter_any():
+                    counter.feed(chunk)
+                    if limit and counter.count >= limit:
+                        self._counters['early_exits'] += 1
+                        return limit
+                return counter.count
+
+    async def count_items(self, url: Text, limit: Optional[int] = None) -> int:
+        """Number of elements of the JSON array returned by `url`, counted as the response streams in
+
+        When `limit` is given, counting stops as soon as `limit` elements are seen. The rest of
+        the response is not read, so that connection is closed rather than returned to the pool.
+        """
+        return await self._with_deadline(lambda: self._count_items(url, limit))
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info('Closed Beratungsnetz API session')
+        self._session = None
+
+    def stats(self) -> Dict[Text, Any]:
+        """Pool and failure statistics, useful to tune the pool size and the latency budget"""
+        return {
+            'breaker': self.breaker.state,
+            'breaker_open': self.breaker.state != CLOSED,
+            'breaker_opened': self.breaker.times_opened,
+            'timeouts': self._counters['timeouts'],
+            'failures': self._counters['failures'],
+            'retries': self._counters['retries'],
+            'short_circuited': self._counters['short_circuited'],
+            'pool_size': self.pool_size,
+            'in_flight': self._in_flight,
+            'peak_in_flight': self._peak_in_flight,
+            'requests': self._counters['requests'],
+            'early_exits': self._counters['early_exits'],
+            'connections_created': self._counters['connections_created'],
+            'connections_reused': self._counters['connections_reused'],
+            'connections_queued': self._counters['connections_queued'],
+            'dns_cache_hits': self._counters['dns_cache_hits'],
+            'dns_cache_misses': self._counters['dns_cache_misses'],
+        }
+
+
+# A single client per action server process, closed by scripts/run_action_server.py when its server stops
+bfz_client = BfzClient()
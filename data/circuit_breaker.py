@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Any, Dict, Text
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stops calling a failing backend for a while
+
+    After `failure_threshold` consecutive failures the breaker opens and calls are rejected.
+    Once `reset_timeout` seconds have passed a single trial call is let through (half open),
+    its success closes the breaker again and its failure opens it for another `reset_timeout`.
+    A trial ending without outcome (e.g. cancelled) opens it again too. A trial whose outcome is
+    never recorded is given up after another `reset_timeout` and a new trial is let through.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if (self.state == OPEN and now - self._opened_at >= self.reset_timeout) or \
+                (self.state == HALF_OPEN and now - self._trial_started_at >= self.reset_timeout):
+            self.state = HALF_OPEN
+            self._trial_started_at = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def record_abort(self) -> None:
+        """Records a call ended without outcome, the breaker doesn't stay half open waiting for it"""
+        if self.state == HALF_OPEN:
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'times_opened': self.times_opened,
+        }
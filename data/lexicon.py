@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Filter lexicon used by the action server
+
+The lexicon is precompiled by `scripts/import_questions.py` into `filter_lexicon.json`, a record per
+filter (display name, filter category, context, whether it is a search term) and a table from stemmed
+synonyms to filters. Loading it needs neither pandas nor the CSV files.
+
+Action server workers share a single copy of the lexicon through `MappedFilterLexicon`, a binary file
+written once and memory mapped read only by every worker (see `scripts/run_action_server.py`).
+"""
+import csv
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Text, Tuple, Union
+
+from nltk.stem import SnowballStemmer
+
+FILTER_MAPPING_PATH = 'data/generated/filter_questions/entities/filter_mapping.csv'
+FILTER_SYNONYMS_PATH = 'data/generated/filter_questions/entities/filter_synonyms.csv'
+FILTER_LEXICON_PATH = 'data/generated/filter_questions/entities/filter_lexicon.json'
+
+LEXICON_VERSION = 1
+
+MAPPED_MAGIC = b'MIKILEX1'
+# Magic, number of filters, number of stems
+MAPPED_HEADER = struct.Struct('<8sII')
+# Entries of the mapped lexicon decoded per process, filters and entities repeat across conversations
+MAPPED_CACHE_SIZE = 4096
+
+FilterRecord = namedtuple('FilterRecord', 'display category context is_search_term')
+
+_stemmer = SnowballStemmer('german')
+
+
+# Entities repeat a lot across conversations, stemming each distinct one once is enough
+@lru_cache(maxsize=4096)
+def stem(word: Text) -> Text:
+    return _stemmer.stem(word)
+
+
+class FilterLexicon:
+    """Filters by id and synonym resolution through their stems"""
+
+    def __init__(self, filters: Dict[Text, FilterRecord], stems: Dict[Text, Text]):
+        self.filters = filters
+        self.stems = stems
+
+    def __contains__(self, filter: Text) -> bool:
+        return filter in self.filters
+
+    def __getitem__(self, filter: Text) -> FilterRecord:
+        return self.filters[filter]
+
+    def __iter__(self) -> Iterator[Text]:
+        return iter(self.filters)
+
+    def resolve(self, entity: Text) -> Optional[Text]:
+        """Filter of an entity value which is not a filter id, through its stem"""
+        return self.stems.get(stem(entity))
+
+    @classmethod
+    def load(cls, path: Text) -> 'FilterLexicon':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != LEXICON_VERSION:
+            raise ValueError(f'Unsupported filter lexicon version in {path}')
+        filters = {f: FilterRecord(*record) for f, record in data['filters'].items()}
+        return cls(filters, data['stems'])
+
+    @classmethod
+    def from_csv(cls, mapping_path: Text, synonyms_path: Text) -> 'FilterLexicon':
+        """Lexicon read from filter_mapping.csv and filter_synonyms.csv, for data imported before the lexicon"""
+        with open(mapping_path, newline='', encoding='utf-8') as f:
+            filters = OrderedDict(
+                (r['filter'], FilterRecord(r['display'], r['filter_category'], r['context'], r['is_search_term'] == 'True'))
+                for r in csv.DictReader(f))
+        with open(synonyms_path, newline='', encoding='utf-8') as f:
+            stems = OrderedDict((r['synonym'], r['filter']) for r in csv.DictReader(f))
+        return cls(filters, stems)
+
+
+class MappedFilterLexicon:
+    """Read only view of a lexicon file written by `write_mapped_lexicon`, the file is memory mapped
+
+    The file has two tables sorted by key, filters (`filter\\0display\\0category\\0context\\0is_search_term`)
+    and stems (`stem\\0filter`), each an array of entry offsets followed by the UTF-8 entries. Lookups are
+    binary searches in the mapped pages, which the processes mapping the file share.
+    """
+
+    def __init__(self, path: Text):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._num_filters, self._num_stems = MAPPED_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAPPED_MAGIC:
+            raise ValueError(f'{path} is not a filter lexicon')
+        num_offsets = self._num_filters + self._num_stems + 2
+        self._offsets = memoryview(self._mmap)[MAPPED_HEADER.size:MAPPED_HEADER.size + 4 * num_offsets].cast('I')
+        self._find = lru_cache(maxsize=MAPPED_CACHE_SIZE)(self._find)
+
+    def _find(self, first: int, n: int, key: Text) -> Optional[List[Text]]:
+        """Fields of the entry `key` of the table starting at offset `first` with `n` entries"""
+        key = key.encode('utf-8')
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._offsets[first + mid]
+            end = self._mmap.find(b'\0', start, self._offsets[first + mid + 1])
+            if self._mmap[start:end] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == n:
+            return None
+        fields = self._mmap[self._offsets[first + lo]:self._offsets[first + lo + 1]].decode('utf-8').split('\0')
+        return fields[1:] if fields[0] == key.decode('utf-8') else None
+
+    def _record(self, filter: Text) -> Optional[FilterRecord]:
+        fields = self._find(0, self._num_filters, filter)
+        if fields is None:
+            return None
+        display, category, context, is_search_term = fields
+        return FilterRecord(display, category, context, is_search_term == '1')
+
+    def __contains__(self, filter: Text) -> bool:
+        return self._find(0, self._num_filters, filter) is not None
+
+    def __getitem__(self, filter: Text) -> FilterRecord:
+        record = self._record(filter)
+        if record is None:
+            raise KeyError(filter)
+        return record
+
+    def __iter__(self) -> Iterator[Text]:
+        for i in range(self._num_filters):
+            start = self._offsets[i]
+            yield self._mmap[start:self._mmap.find(b'\0', start)].decode('utf-8')
+
+    def resolve(self, entity: Text) -> Optional[Text]:
+        fields = self._find(self._num_filters + 1, self._num_stems, stem(entity))
+        return fields[0] if fields else None
+
+    def close(self) -> None:
+        self._find.cache_clear()
+        self._offsets.release()
+        self._mmap.close()
+
+
+def write_mapped_lexicon(lexicon: FilterLexicon, path: Text) -> None:
+    """Writes `lexicon` in the format of `MappedFilterLexicon`, replacing `path` atomically"""
+
+    def field(value: Union[Text, bool]) -> Text:
+        value = ('1' if value else '0') if isinstance(value, bool) else str(value)
+        if '\0' in value:
+            raise ValueError(f'Unsupported character in lexicon field {value!r}')
+        return value
+
+    def table(entries: List[Tuple[Text, ...]]) -> List[bytes]:
+        # Sorted as the binary search compares them, by the UTF-8 bytes of the key
+        return sorted(('\0'.join(field(v) for v in entry).encode('utf-8') for entry in entries),
+                      key=lambda e: e.split(b'\0', 1)[0])
+
+    filters = table([(f,) + tuple(record) for f, record in lexicon.filters.items()])
+    stems = table(list(lexicon.stems.items()))
+
+    offsets = array('I')
+    position = MAPPED_HEADER.size + 4 * (len(filters) + len(stems) + 2)
+    for entries in [filters, stems]:
+        for entry in entries:
+            offsets.append(position)
+            position += len(entry)
+        offsets.append(position)
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAPPED_HEADER.pack(MAPPED_MAGIC, len(filters), len(stems)))
+        f.write(offsets.tobytes())
+        for entry in filters + stems:
+            f.write(entry)
+    os.replace(tmp, path)
+
+
+def load_lexicon() -> Union[FilterLexicon, MappedFilterLexicon]:
+    """Lexicon of the action server: the shared memory mapped one, the precompiled one or the CSV files"""
+    # Memory mapped lexicon shared by the workers of the action server, set by scripts/run_action_server.py
+    mmap_path = os.environ.get('FILTER_LEXICON_MMAP_PATH')
+    if mmap_path:
+        return MappedFilterLexicon(mmap_path)
+    if os.path.exists(FILTER_LEXICON_PATH):
+        return FilterLexicon.load(FILTER_LEXICON_PATH)
+    return FilterLexicon.from_csv(FILTER_MAPPING_PATH, FILTER_SYNONYMS_PATH)
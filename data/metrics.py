@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Metrics of the action server in Prometheus text format
+
+Metrics are plain counters kept in process, recording them costs a dictionary lookup and an addition,
+so they stay enabled in production. They are served on `http://<host>:METRICS_PORT/metrics`, the server
+is started together with an event loop lag probe the first time an action runs.
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 5056))
+# Seconds between two event loop lag measurements
+LOOP_LAG_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+def _labels(label_name: Optional[Text], label: Optional[Text], extra: Text = '') -> Text:
+    labels = []
+    if label_name is not None:
+        value = str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{label_name}="{value}"')
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _number(value: float) -> Text:
+    # Prometheus only parses numbers, flags are rendered as 1 and 0
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def unparsable_samples(text: Text) -> List[Text]:
+    """Sample lines of a rendered registry whose value is not a number, Prometheus rejects a scrape with any"""
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            try:
+                float(line.rsplit(' ', 1)[1])
+            except (IndexError, ValueError):
+                lines.append(line)
+    return lines
+
+
+class Counter:
+    def __init__(self, name: Text, help: Text, label_name: Optional[Text] = None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self._values = defaultdict(int)
+
+    def inc(self, label: Optional[Text] = None, amount: float = 1) -> None:
+        self._values[label] += amount
+
+    def render(self) -> List[Text]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_labels(self.label_name, label)} {_number(value)}'
+                  for label, value in sorted(self._values.items(), key=lambda i: str(i[0]))]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: Text, help: Text, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 label_name: Optional[Text] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label_name = label_name
+        # label -> [count per bucket (last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value: float, label: Optional[Text] = None) -> None:
+        values = self._values.get(label)
+        if values is None:
+            values = self._values[label] = [[0] * (len(self.buckets) + 1), 0]
+        values[0][bisect_left(self.buckets, value)] += 1
+        values[1] += value
+
+    def render(self) -> List[Text]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label, (counts, total) in sorted(self._values.items(), key=lambda i: str(i[0])):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + ('+Inf' if bound == float('inf') else _number(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_name, label, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_name, label)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_name, label)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: Text, stats: Callable[[], Dict[Text, Any]]) -> None:
+        """Exposes the numeric values of a stats() dictionary as gauges named `<prefix>_<key>`"""
+        self.collectors.append((prefix, stats))
+
+    def render(self) -> Text:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for prefix, stats in self.collectors:
+            for key, value in stats().items():
+                if isinstance(value, (bool, int, float)):
+                    lines += [f'# TYPE {prefix}_{key} gauge', f'{prefix}_{key} {_number(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+ACTION_LATENCY = registry.register(Histogram(
+    'action_latency_seconds', 'Time to run an action', label_name='action'))
+BACKEND_LATENCY = registry.register(Histogram(
+    'backend_request_latency_seconds', 'Time of a request attempt to the Beratungsnetz API'))
+BACKEND_RESPONSES = registry.register(Counter(
+    'backend_responses_total', 'Responses of the Beratungsnetz API by status code, timeout or error', label_name='status'))
+FILTERS_PER_REQUEST = registry.register(Histogram(
+    'filters_per_request', 'Number of resolved filters of a filter question', buckets=COUNT_BUCKETS))
+SYNONYM_RESOLUTIONS = registry.register(Counter(
+    'synonym_resolutions_total', 'Entities resolved to a filter through their stem'))
+UNRESOLVED_ENTITIES = registry.register(Counter(
+    'unresolved_entities_total', 'Entities which could not be resolved to a filter'))
+RELAXED_SEARCHES = registry.register(Counter(
+    'relaxed_searches_total', 'Searches for results with fewer filters by outcome', label_name='outcome'))
+LOOP_LAG = registry.register(Histogram(
+    'event_loop_lag_seconds', 'Delay of the event loop in waking up a sleeping task'))
+
+
+def timed_action(run):
+    """Decorator of Action.run recording its latency"""
+
+    @functools.wraps(run)
+    async def timed_run(self, dispatcher, tracker, domain):
+        start_server()
+        start = time.perf_counter()
+        try:
+            return await run(self, dispatcher, tracker, domain)
+        finally:
+            ACTION_LATENCY.observe(time.perf_counter() - start, self.name())
+
+    return timed_run
+
+
+async def _probe_loop_lag():
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+_background = []
+
+
+def start_server() -> None:
+    """Starts the metrics endpoint and the loop lag probe on the running loop, once"""
+    if _background or not METRICS_PORT:
+        return
+
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, '0.0.0.0', METRICS_PORT).start()
+            logger.info(f'Serving metrics on port {METRICS_PORT}')
+        except OSError as e:
+            logger.warning(f'Could not serve metrics on port {METRICS_PORT}: {e!r}')
+
+    _background.append(asyncio.ensure_future(serve()))
+    _background.append(asyncio.ensure_future(_probe_loop_lag()))
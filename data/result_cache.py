@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, they can be tuned per deployment through the environment
+CACHE_SIZE = int(os.environ.get('BFZ_CACHE_SIZE', 1024))
+CACHE_TTL = float(os.environ.get('BFZ_CACHE_TTL', 300))
+CACHE_STALE_TTL = float(os.environ.get('BFZ_CACHE_STALE_TTL', 3600))
+
+# Cache shared by action servers started separately, the workers of scripts/run_action_server.py --shared-cache attach
+# their store themselves
+SHARED_CACHE_PATH = os.environ.get('BFZ_SHARED_CACHE_PATH')
+SHARED_CACHE_SIZE = int(os.environ.get('BFZ_SHARED_CACHE_SIZE', 16384))
+# Seconds a worker waits for another one writing to the shared cache
+SHARED_CACHE_TIMEOUT = 0.05
+# Number of writes between two evictions of old entries from the shared cache
+SHARED_CACHE_PRUNE_EVERY = 256
+
+
+class SharedCountStore:
+    """Result counts shared by the processes of the action server, in an SQLite database
+
+    The database is meant for local shared memory (/dev/shm), a lookup is a few microseconds. Entries
+    keep the wall clock time they were stored at, their freshness is left to the caller. Errors, e.g. a
+    write lock held too long by another worker, are treated as a miss.
+    """
+
+    def __init__(self, path: Text, max_size: int = SHARED_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        # Opened on first use, connections must not be shared across forked processes
+        self._connection = None
+        self._writes = 0
+        self.errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=SHARED_CACHE_TIMEOUT, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS counts (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)')
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def _db(self) -> sqlite3.Connection:
+        # Kept only once set up, a failed setup (e.g. the database locked by another worker) is retried on next use
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def create(self) -> None:
+        """Creates the database, meant for the parent process before the workers are forked"""
+        self._connect().close()
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Value of `key` and the time it was stored at"""
+        try:
+            row = self._db().execute('SELECT value, stored_at FROM counts WHERE key = ?', (json.dumps(key),)).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f'Could not read the shared result cache: {e!r}')
+            return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: Hashable, value: Any, max_age: float) -> None:
+        try:
+            db = self._db()
+            db.execute('INSERT OR REPLACE INTO counts VALUES (?, ?, ?)', (json.dumps(key), json.dumps(value), time.time()))
+            self._writes += 1
+            if self._writes % SHARED_CACHE_PRUNE_EVERY == 0:
+                db.execute('DELETE FROM counts WHERE stored_at < ?', (time.time() - max_age,))
+                db.execute('DELETE FROM counts WHERE key NOT IN (SELECT key FROM counts ORDER BY stored_at DESC LIMIT ?)',
+                           (self.max_size,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f'Could not write to the shared result cache: {e!r}')
+
+
+class ResultCountCache:
+    """Bounded LRU cache of result counts with TTL eviction
+
+    Entries younger than `ttl` are served as they are. Entries older than `ttl` but younger
+    than `ttl + stale_ttl` are served immediately while a refresh runs in the background
+    (stale while revalidate). Older entries are treated as missing.
+
+    With a `shared` store, entries missing in this process are looked up there, and fetched values are
+    stored there too, so that the workers of the action server fetch a count once between them.
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: float = CACHE_TTL, stale_ttl: float = CACHE_STALE_TTL,
+                 shared: Optional[SharedCountStore] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+
+        # key -> (value, time stored), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        self.shared_hits = 0
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if self.max_size <= 0:
+            self.misses += 1
+            return await fetch()
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if self.shared is not None and (entry is None or now - entry[1] >= self.ttl):
+            # Another worker might have fetched the value since
+            shared_entry = self._get_shared(key, now)
+            if shared_entry is not None and (entry is None or shared_entry[1] > entry[1]):
+                self.shared_hits += 1
+                entry = shared_entry
+                self._put(key, *entry)
+
+        if entry is not None:
+            value, stored_at = entry
+            age = now - stored_at
+
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._refresh(key, fetch)
+                return value
+
+            del self._entries[key]
+
+        self.misses += 1
+        value = await fetch()
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._put(key, value, time.monotonic())
+        if self.shared is not None:
+            self.shared.put(key, value, self.ttl + self.stale_ttl)
+
+    def _put(self, key: Hashable, value: Any, stored_at: float) -> None:
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key: Hashable, now: float) -> Optional[Tuple[Any, float]]:
+        """Entry of another worker, with its age carried over to the monotonic clock of this process"""
+        entry = self.shared.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        age = time.time() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            return None
+        return value, now - age
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                self.put(key, await fetch())
+            except Exception as e:
+                # The stale value is kept, the next access will try again
+                self.refresh_errors += 1
+                logger.warning(f'Background refresh of {key} failed: {e!r}')
+            finally:
+                del self._refreshing[key]
+
+        self._refreshing[key] = asyncio.ensure_future(refresh())
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshing': len(self._refreshing),
+            'refresh_errors': self.refresh_errors,
+            'shared': self.shared is not None,
+            'shared_hits': self.shared_hits,
+            'shared_errors': self.shared.errors if self.shared is not None else 0,
+        }
+
+
+# A single cache per action server process, backed by the cache shared by the workers if there is one
+result_cache = ResultCountCache(shared=SharedCountStore(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Text
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing the same key into a single call
+
+    The first caller for a key starts the call, callers arriving while it is in flight wait
+    for the same future and get the same result or the same exception. The call is cancelled
+    when all its callers are cancelled.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        # Number of callers waiting for each call in flight
+        self._waiters = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            self._waiters[future] = 0
+            future.add_done_callback(lambda f: self._done(key, f))
+
+        # A cancelled waiter must not cancel the call the other waiters are sharing, the last one does
+        self._waiters[future] += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._waiters.get(future) == 1:
+                # Callers arriving from now on start a new call rather than wait for the cancelled one
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+                future.cancel()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters[future] -= 1
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        self._waiters.pop(future, None)
+        # Mark the exception as retrieved, in case all the waiters were cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            'in_flight': len(self._in_flight),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+        }
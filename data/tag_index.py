@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Local index of the Beratungsnetz catalogue to count filter results without a backend request
+
+The index is a single file with one bitmap per tag filter of the filter mapping, bit `i` of a bitmap is
+set when the `i`-th item of the catalogue has the tag. Counting the results of a filter request is then
+the intersection of a few bitmaps.
+
+Only requests with tag filters alone are answered locally. Which fields the `search` parameter of
+exportItems looks at, and how it tokenises and stems them, is not known here, so requests with a search
+term are always sent to the API.
+
+The index is built by a sync job which can run on a schedule, e.g.:
+
+    python3 -m data.tag_index --output tag_index/tag_index.bin --interval 3600
+
+or from a local copy of the catalogue (a JSON list of items as returned by exportItems):
+
+    python3 -m data.tag_index --output tag_index/tag_index.bin --catalogue catalogue.json
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+TAG_INDEX_PATH = os.environ.get('BFZ_TAG_INDEX_PATH', 'tag_index/tag_index.bin')
+# Maximum age in seconds of an index before requests fall back to the live API
+TAG_INDEX_MAX_AGE = float(os.environ.get('BFZ_TAG_INDEX_MAX_AGE', 24 * 3600))
+# Seconds between checks whether the index file was replaced by the sync job
+TAG_INDEX_CHECK_INTERVAL = 10
+
+# Keys of the catalogue items
+ITEM_ID = 'id'
+ITEM_TAGS = 'tags'
+
+# Seconds allowed to download the whole catalogue
+CATALOGUE_TIMEOUT = 120
+
+MAGIC = b'MIKITIX1'
+HEADER = struct.Struct('<8sI')
+
+
+def _item_tags(item: Dict[Text, Any]) -> List[Text]:
+    tags = item.get(ITEM_TAGS) or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return [t.strip() for t in tags]
+
+
+def build_index(items: List[Dict[Text, Any]], tags: Iterable[Text]) -> bytes:
+    """Serialised index of the catalogue `items` for the given tag filters"""
+    num_bytes = (len(items) + 7) // 8
+
+    tag_bits = {t: 0 for t in tags}
+    for i, item in enumerate(items):
+        for t in _item_tags(item):
+            if t in tag_bits:
+                tag_bits[t] |= 1 << i
+
+    header = json.dumps({
+        'built_at': time.time(),
+        'num_items': len(items),
+        'bitmap_bytes': num_bytes,
+        'tags': {t: n for n, t in enumerate(tag_bits)},
+    }).encode()
+
+    return b''.join([HEADER.pack(MAGIC, len(header)), header] +
+                    [bits.to_bytes(num_bytes, 'little') for bits in tag_bits.values()])
+
+
+class TagIndex:
+    """Read only view of an index file, the bitmaps are memory mapped"""
+
+    def __init__(self, path: Text):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a tag index')
+        header = json.loads(self._mmap[HEADER.size:HEADER.size + header_size].decode())
+
+        self.built_at = header['built_at']
+        self.num_items = header['num_items']
+        self._bitmap_bytes = header['bitmap_bytes']
+        self._tags = header['tags']
+        self._data_offset = HEADER.size + header_size
+
+    def _bitmap(self, n: int) -> int:
+        start = self._data_offset + n * self._bitmap_bytes
+        return int.from_bytes(self._mmap[start:start + self._bitmap_bytes], 'little')
+
+    def age(self) -> float:
+        return time.time() - self.built_at
+
+    def count(self, query: Tuple[Tuple[Text, ...], Optional[Text]]) -> Optional[int]:
+        """Number of items with all the tags of `query`, None if it can't be answered (e.g. it has a search term)"""
+        tag_filters, search_term = query
+
+        if search_term or any(t not in self._tags for t in tag_filters):
+            return None
+
+        bits = (1 << self.num_items) - 1
+        for t in tag_filters:
+            bits &= self._bitmap(self._tags[t])
+
+        return bin(bits).count('1')
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class LocalTagIndex:
+    """Answers result counts from the index file while it is fresh, reloading it when it is replaced"""
+
+    def __init__(self, path: Text = TAG_INDEX_PATH, max_age: float = TAG_INDEX_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._index: Optional[TagIndex] = None
+        self._mtime = None
+        self._checked_at = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _current(self) -> Optional[TagIndex]:
+        now = time.monotonic()
+        if now - self._checked_at < TAG_INDEX_CHECK_INTERVAL:
+            return self._index
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime != self._mtime:
+            self._mtime = mtime
+            index, self._index = self._index, None
+            if index is not None:
+                index.close()
+            if mtime is not None:
+                try:
+                    self._index = TagIndex(self.path)
+                    logger.info(f'Loaded tag index {self.path} with {self._index.num_items} items')
+                except (OSError, ValueError) as e:
+                    logger.warning(f'Could not load tag index {self.path}: {e!r}')
+
+        return self._index
+
+    def count(self, query: Tuple[Tuple[Text, ...], Optional[Text]]) -> Optional[int]:
+        index = self._current()
+        num_documents = None
+        if index is not None and index.age() < self.max_age:
+            num_documents = index.count(query)
+
+        if num_documents is None:
+            self.fallbacks += 1
+        else:
+            self.hits += 1
+        return num_documents
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            'loaded': self._index is not None,
+            'age': self._index.age() if self._index is not None else None,
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+        }
+
+
+tag_index = LocalTagIndex()
+
+
+########################################
+# Sync job
+########################################
+
+def read_tags(mapping_path: Text) -> List[Text]:
+    """Tag filters of the filter mapping, search terms are left out"""
+    with open(mapping_path, newline='') as f:
+        return [r['filter'] for r in csv.DictReader(f) if r['is_search_term'] != 'True']
+
+
+async def fetch_catalogue() -> List[Dict[Text, Any]]:
+    from .actions import BFZ_API_URL
+    from .bfz_client import BfzClient
+
+    # The whole catalogue takes far longer than the budget of a conversation turn
+    client = BfzClient(pool_size=1, request_timeout=CATALOGUE_TIMEOUT, request_budget=3 * CATALOGUE_TIMEOUT)
+    keys = ','.join([ITEM_ID, ITEM_TAGS])
+    try:
+        res = await client.get_text(f'{BFZ_API_URL}/actions/exportItems?format=JSON&keys={keys}')
+    finally:
+        await client.close()
+    return json.loads(res)
+
+
+def sync(args) -> None:
+    if args.catalogue:
+        with open(args.catalogue) as f:
+            items = json.load(f)
+    else:
+        items = asyncio.run(fetch_catalogue())
+
+    tags = read_tags(args.filter_mapping)
+    data = build_index(items, tags)
+
+    # Replace atomically, the action server might be reading the previous index
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    tmp = f'{args.output}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, args.output)
+    logger.info(f'Wrote tag index {args.output} with {len(items)} items and {len(tags)} tags')
+
+
+def main():
+    from .lexicon import FILTER_MAPPING_PATH
+
+    parser = argparse.ArgumentParser(description='Build the local tag index of the Beratungsnetz catalogue')
+    parser.add_argument('--output', type=str, help='Path of the index file', default=TAG_INDEX_PATH)
+    parser.add_argument('--filter-mapping', type=str, help='Path of filter_mapping.csv', default=FILTER_MAPPING_PATH)
+    parser.add_argument('--catalogue', type=str, help='Build from a local JSON catalogue rather than the API')
+    parser.add_argument('--interval', type=float, help='Rebuild the index every INTERVAL seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        try:
+            sync(args)
+        except Exception as e:
+            if not args.interval:
+                raise
+            logger.error(f'Tag index sync failed: {e!r}')
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import logging
 from typing import Any, List, Type, Text, Dict, Union, Tuple, Optional
 
+import numpy as np
+
 from rasa.core.constants import (
     DEFAULT_NLU_FALLBACK_THRESHOLD,
     DEFAULT_NLU_FALLBACK_AMBIGUITY_THRESHOLD,
@@ -41,8 +43,38 @@ class SingleTokenFallbackClassifier(IntentClassifier):
         if not self._should_fallback(message):
             return
 
+        self._fallback(message)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        """Same as `process` on each message, with token counts and threshold decisions computed at once"""
+        if not messages:
+            return
+
+        threshold = self.component_config[THRESHOLD_KEY]
+        max_num_toks = self.component_config[MAX_NUM_TOKS]
+
+        confidences = np.array([_confidence(m) for m in messages], dtype=float)
+        candidates = np.flatnonzero(confidences < threshold)
+        # Only the tokens of messages below the threshold are looked at. A message with few tokens can't have
+        # too many tokens longer than one character, the others are counted until there are too many.
+        num_tokens = np.array([len(messages[i].data['text_tokens']) for i in candidates], dtype=int)
+        should_fallback = np.zeros(len(messages), dtype=bool)
+        should_fallback[candidates[num_tokens <= max_num_toks]] = True
+        for i in candidates[num_tokens > max_num_toks]:
+            should_fallback[i] = _count_long_tokens(messages[i].data['text_tokens'], max_num_toks + 1) <= max_num_toks
+
+        for i in np.flatnonzero(should_fallback):
+            message = messages[i]
+            logger.debug(
+                f"NLU confidence {_confidence(message)} for intent "
+                f"'{message.data[INTENT].get(INTENT_NAME_KEY)}' is lower "
+                f"than NLU threshold {self.component_config[THRESHOLD_KEY]:.2f}."
+            )
+            self._fallback(message)
+
+    def _fallback(self, message: Message) -> None:
         # we assume that the confidence of fallback is 1 - confidence of top intent
-        confidence = 1 - message.data[INTENT][PREDICTED_CONFIDENCE_KEY]
+        confidence = 1 - _confidence(message)
         message.data[INTENT] = _fallback_intent(self.component_config[INTENT_NAME], confidence)
         message.data.setdefault(INTENT_RANKING_KEY, [])
         message.data[INTENT_RANKING_KEY].insert(0, _fallback_intent(self.component_config[INTENT_NAME], confidence))
@@ -62,10 +94,27 @@ class SingleTokenFallbackClassifier(IntentClassifier):
         return False
 
     def _nlu_confidence_below_threshold(self, message: Message) -> Tuple[bool, float]:
-        nlu_confidence = message.data[INTENT].get(PREDICTED_CONFIDENCE_KEY)
+        nlu_confidence = _confidence(message)
         return nlu_confidence < self.component_config[THRESHOLD_KEY], nlu_confidence
 
 
+def _confidence(message: Message) -> float:
+    """Confidence of the predicted intent, a message without one is taken as not confident at all"""
+    confidence = message.data[INTENT].get(PREDICTED_CONFIDENCE_KEY)
+    return 0.0 if confidence is None else confidence
+
+
+def _count_long_tokens(tokens: List[Any], limit: int) -> int:
+    """Number of tokens longer than one character, counting stops at `limit`"""
+    n = 0
+    for tok in tokens:
+        if tok.end - tok.start > 1:
+            n += 1
+            if n >= limit:
+                break
+    return n
+
+
 def _fallback_intent(intent_name: str, confidence: float) -> Dict[Text, Union[Text, float]]:
     return {
         INTENT_NAME_KEY: intent_name,
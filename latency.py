@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import time
+from collections import deque, OrderedDict
+from typing import Any, Deque, Dict, List, Optional, Text
+
+from rasa.nlu.components import Component
+from rasa.shared.nlu.training_data.message import Message
+
+LABEL_KEY = "label"
+WINDOW_KEY = "window"
+REPORT_INTERVAL_KEY = "report_interval"
+METRICS_FILE_KEY = "metrics_file"
+
+# Property of the message with the time of the previous checkpoint, not part of the parse output
+CHECKPOINT_TIME = "latency_checkpoint_time"
+
+PERCENTILES = (50, 90, 99)
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyCheckpoint(Component):
+    """Measures the time taken by the pipeline components between two checkpoints
+
+    Checkpoints are interleaved with the components of the pipeline, each one records the time since the
+    previous checkpoint under its `label`. A checkpoint without label only starts the measurement, e.g.:
+
+        - name: latency.LatencyCheckpoint
+        - name: SpacyNLP
+        - name: latency.LatencyCheckpoint
+          label: SpacyNLP
+
+    Rolling percentiles of the last `window` messages are logged every `report_interval` seconds and
+    written to `metrics_file` if set, or to the file of the `NLU_LATENCY_METRICS_FILE` environment variable.
+    """
+
+    defaults = {
+        LABEL_KEY: None,
+        WINDOW_KEY: 1000,
+        REPORT_INTERVAL_KEY: 60,
+        METRICS_FILE_KEY: None,
+    }
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        label = self.component_config[LABEL_KEY]
+        previous = message.get(CHECKPOINT_TIME)
+        if label and previous is not None:
+            recorder = _recorder(self.component_config)
+            recorder.record(label, now - previous)
+            recorder.maybe_report(now)
+        # Taken again so that recording is not counted in the next component's time
+        message.set(CHECKPOINT_TIME, time.perf_counter())
+
+
+class LatencyRecorder:
+    """Durations of the last `window` messages per label"""
+
+    def __init__(self, window: int, report_interval: float, metrics_file: Optional[Text] = None) -> None:
+        self.window = window
+        self.report_interval = report_interval
+        self.metrics_file = metrics_file
+        self.durations: Dict[Text, Deque[float]] = OrderedDict()
+        self.counts: Dict[Text, int] = {}
+        self.last_report = time.perf_counter()
+
+    def record(self, label: Text, seconds: float) -> None:
+        durations = self.durations.get(label)
+        if durations is None:
+            durations = self.durations[label] = deque(maxlen=self.window)
+            self.counts[label] = 0
+        durations.append(seconds)
+        self.counts[label] += 1
+
+    def summary(self) -> Dict[Text, Dict[Text, Any]]:
+        """Count, mean and percentiles in milliseconds per label, in pipeline order"""
+        summary = OrderedDict()
+        for label, durations in self.durations.items():
+            values = sorted(durations)
+            stats = OrderedDict({"count": self.counts[label], "mean_ms": 1000 * sum(values) / len(values)})
+            for p in PERCENTILES:
+                stats[f"p{p}_ms"] = 1000 * _percentile(values, p)
+            summary[label] = stats
+        return summary
+
+    def maybe_report(self, now: float) -> None:
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        self.report()
+
+    def report(self) -> None:
+        summary = self.summary()
+        for label, stats in summary.items():
+            logger.info(
+                f"NLU latency of {label} over the last {min(stats['count'], self.window)} messages: "
+                + ", ".join(f"{key[:-3]} {value:.2f}ms" for key, value in stats.items() if key != "count")
+            )
+        if self.metrics_file:
+            tmp = f"{self.metrics_file}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(summary, f, indent=2)
+            os.replace(tmp, self.metrics_file)
+
+
+# One recorder per process shared by the checkpoints with the same settings
+_recorders: Dict[tuple, LatencyRecorder] = {}
+
+
+def _recorder(config: Dict[Text, Any]) -> LatencyRecorder:
+    metrics_file = config[METRICS_FILE_KEY] or os.environ.get("NLU_LATENCY_METRICS_FILE")
+    key = (config[WINDOW_KEY], config[REPORT_INTERVAL_KEY], metrics_file)
+    recorder = _recorders.get(key)
+    if recorder is None:
+        recorder = _recorders[key] = LatencyRecorder(*key)
+    return recorder
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
@@ -0,0 +1,154 @@
+import copy
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from rasa.nlu.components import Component
+from rasa.nlu.model import Interpreter, Metadata
+from rasa.shared.nlu.constants import (
+    ENTITIES,
+    ENTITY_ATTRIBUTE_END,
+    ENTITY_ATTRIBUTE_START,
+    ENTITY_ATTRIBUTE_VALUE,
+    TEXT,
+)
+
+MAX_SIZE_KEY = "max_size"
+REPORT_EVERY_KEY = "report_every"
+
+WORD = re.compile(r"\S+")
+
+logger = logging.getLogger(__name__)
+
+
+class NLUParseCache(Component):
+    """Caches parse results of the model by text, repeated messages skip the other components
+
+    Button payloads and frequent phrasings are parsed over and over with the same result. With this
+    component in the pipeline, `Interpreter.parse` returns a copy of the result of an earlier message with
+    the same text up to whitespace, as long as it is in the least recently used `max_size` results.
+    Entity offsets are moved to the whitespace of the new text. Results are cached per loaded model and
+    keyed by its training time, so a new model starts with an empty cache.
+    """
+
+    defaults = {
+        MAX_SIZE_KEY: 10000,
+        # Number of lookups between two logs of the hit and miss counters, 0 to not log them
+        REPORT_EVERY_KEY: 1000,
+    }
+
+    def __init__(self, component_config: Optional[Dict[Text, Any]] = None, fingerprint: Optional[Text] = None) -> None:
+        super().__init__(component_config)
+        self.fingerprint = fingerprint
+        self.results: "OrderedDict[Tuple[Optional[Text], Text], Tuple[Dict[Text, Any], List[bool]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        _patch_interpreter()
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Optional[Text] = None,
+        model_metadata: Optional[Metadata] = None,
+        cached_component: Optional["NLUParseCache"] = None,
+        **kwargs: Any,
+    ) -> "NLUParseCache":
+        fingerprint = model_metadata.get("trained_at") if model_metadata else None
+        return cls(meta, fingerprint)
+
+    def process(self, message: Any, **kwargs: Any) -> None:
+        # Results are stored by the interpreter once all the components processed the message
+        pass
+
+    def get(self, text: Text) -> Optional[Dict[Text, Any]]:
+        normalised = _normalise(text)
+        cached = self.results.get((self.fingerprint, normalised))
+        if cached is None:
+            self.misses += 1
+            self._maybe_report()
+            return None
+
+        self.results.move_to_end((self.fingerprint, normalised))
+        self.hits += 1
+        self._maybe_report()
+        result, value_is_text = cached
+        result = copy.deepcopy(result)
+        result[TEXT] = text
+        positions = _positions(text)
+        for entity, is_text in zip(result.get(ENTITIES, []), value_is_text):
+            entity[ENTITY_ATTRIBUTE_START] = positions[entity[ENTITY_ATTRIBUTE_START]]
+            entity[ENTITY_ATTRIBUTE_END] = positions[entity[ENTITY_ATTRIBUTE_END] - 1] + 1
+            if is_text:
+                entity[ENTITY_ATTRIBUTE_VALUE] = text[entity[ENTITY_ATTRIBUTE_START]:entity[ENTITY_ATTRIBUTE_END]]
+        return result
+
+    def put(self, text: Text, result: Dict[Text, Any]) -> None:
+        """Stores a copy of `result` with entity offsets in the normalised text"""
+        normalised = _normalise(text)
+        index = {p: i for i, p in enumerate(_positions(text))}
+        result = copy.deepcopy(result)
+        value_is_text = []
+        for entity in result.get(ENTITIES, []):
+            start, end = entity.get(ENTITY_ATTRIBUTE_START), entity.get(ENTITY_ATTRIBUTE_END)
+            if start not in index or end is None or end - 1 not in index:
+                # Entities are expected to start and end on words, others are not cached
+                return
+            value_is_text.append(entity.get(ENTITY_ATTRIBUTE_VALUE) == text[start:end])
+            entity[ENTITY_ATTRIBUTE_START], entity[ENTITY_ATTRIBUTE_END] = index[start], index[end - 1] + 1
+
+        self.results[(self.fingerprint, normalised)] = (result, value_is_text)
+        self.results.move_to_end((self.fingerprint, normalised))
+        while len(self.results) > self.component_config[MAX_SIZE_KEY]:
+            self.results.popitem(last=False)
+
+    def _maybe_report(self) -> None:
+        every = self.component_config[REPORT_EVERY_KEY]
+        if every and (self.hits + self.misses) % every == 0:
+            logger.info(
+                f"NLU parse cache: {self.hits} hits, {self.misses} misses, {len(self.results)} cached results"
+            )
+
+
+def _normalise(text: Text) -> Text:
+    return " ".join(text.split())
+
+
+def _positions(text: Text) -> List[int]:
+    """Position in `text` of every character of its normalised text"""
+    positions = []
+    for match in WORD.finditer(text):
+        if positions:
+            # The single space between two words stands for the whitespace before the word
+            positions.append(match.start() - 1)
+        positions.extend(range(match.start(), match.end()))
+    return positions
+
+
+def _patch_interpreter() -> None:
+    """Makes `Interpreter.parse` look up and store results in the cache component of the pipeline"""
+    if getattr(Interpreter.parse, "_parse_cache", False):
+        return
+    parse = Interpreter.parse
+
+    def cached_parse(
+        self: Interpreter, text: Text, time: Optional[Any] = None, only_output_properties: bool = True
+    ) -> Dict[Text, Any]:
+        cache = getattr(self, "_nlu_parse_cache", None)
+        if cache is None:
+            cache = self._nlu_parse_cache = next(
+                (c for c in self.pipeline if isinstance(c, NLUParseCache)), False
+            )
+        # Parses with a reference time or with all properties (e.g. `rasa test`) are not cached
+        if not cache or time is not None or not only_output_properties or not text.strip():
+            return parse(self, text, time, only_output_properties)
+
+        result = cache.get(text)
+        if result is None:
+            result = parse(self, text, time, only_output_properties)
+            cache.put(text, result)
+        return result
+
+    cached_parse._parse_cache = True
+    Interpreter.parse = cached_parse
@@ -0,0 +1,59 @@
+"""Throughput of the action server by number of worker processes
+
+Runs `scripts/load_test.py --start-server --workers N` for every number of workers and reports the
+throughput and its scaling over a single worker. The load generator and the API stub run in one
+process, on a machine with few cores they compete with the workers and flatten the scaling.
+Run from the repository root:
+
+    python3 scripts/benchmarks/action_server_scaling.py --workers 1 2 4 --requests 5000 --concurrency 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of the action server by number of workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--stub-latency', type=float, default=0.01, help='Mean latency of the API stub in seconds')
+    parser.add_argument('--shared-cache', action='store_true', help='Share the result counts between the workers')
+    parser.add_argument('--output', type=str, help='Save the results as JSON')
+    return parser.parse_args()
+
+
+def load_test(args, workers, path):
+    cmd = [sys.executable, 'scripts/load_test.py', '--start-server', '--workers', str(workers),
+           '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+           '--stub-latency', str(args.stub_latency), '--output', path]
+    cmd += ['--shared-cache'] if args.shared_cache else []
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    args = get_args()
+
+    results = {'cpus': os.cpu_count(), 'runs': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            report = load_test(args, workers, os.path.join(tmp, f'{workers}.json'))
+            results['runs'].append({k: report[k] for k in ['workers', 'throughput', 'p50', 'p99', 'errors']})
+
+    # Throughput over the throughput with the first number of workers
+    for run in results['runs']:
+        run['scaling'] = run['throughput'] / results['runs'][0]['throughput']
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
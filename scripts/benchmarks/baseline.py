@@ -0,0 +1,92 @@
+"""Timing and baseline helpers shared by the benchmark scripts
+
+Results are dictionaries from benchmark name to seconds, or to megabytes for names ending in `_mb`.
+Baselines are stored as JSON so that a later run can be compared against them and flag slowdowns (or
+memory growth) beyond a threshold. Differences below an absolute floor are not flagged, however large
+relative to the baseline, as timer resolution and rounding make them noise.
+"""
+import json
+import os
+import platform
+import timeit
+
+
+def time_call(fn, repeat=5, min_time=0.2):
+    """Best time of a single call of `fn` in seconds, over `repeat` runs of at least `min_time` seconds"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def is_memory(name):
+    return name.endswith('_mb')
+
+
+def _format(name, value):
+    if is_memory(name):
+        return f'{value:12.1f}MB'
+    if value >= 1e-3:
+        return f'{value * 1e3:12.2f}ms'
+    return f'{value * 1e6:12.2f}us'
+
+
+def save(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},
+                  f, indent=2, sort_keys=True)
+
+
+def compare(path, results, threshold, time_floor=0.0, memory_floor=0.0):
+    """Prints the change of every benchmark against the baseline, returns the names worse than `threshold`
+
+    Times and peak memory are listed separately. Differences smaller than `time_floor` seconds or
+    `memory_floor` megabytes are never flagged.
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    for memory in [False, True]:
+        names = [name for name in results if is_memory(name) == memory]
+        if memory and names:
+            print('Peak memory')
+        for name in names:
+            value = results[name]
+            if name not in baseline:
+                print(f'{name:60s} {_format(name, value)}  (no baseline)')
+                continue
+            change = value / baseline[name] - 1 if baseline[name] else 0.0
+            flag = ''
+            if change > threshold and value - baseline[name] > (memory_floor if memory else time_floor):
+                flag = '  LARGER' if memory else '  SLOWER'
+                regressions.append(name)
+            print(f'{name:60s} {_format(name, value)}  {change:+7.1%}{flag}')
+    return regressions
+
+
+def add_arguments(parser, default_baseline, time_floor=0.0, memory_floor=0.0, threshold=0.2):
+    parser.add_argument('--baseline', type=str, default=default_baseline, help='Path of the JSON baseline')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='Compare against the baseline, fail on slowdowns')
+    parser.add_argument('--threshold', type=float, default=threshold, help='Relative slowdown flagged by --compare')
+    parser.add_argument('--time-floor', type=float, default=time_floor,
+                        help='Slowdowns of fewer seconds are not flagged by --compare')
+    parser.add_argument('--memory-floor', type=float, default=memory_floor,
+                        help='Memory growth of fewer megabytes is not flagged by --compare')
+
+
+def report(args, results):
+    """Saves or compares the results as requested on the command line, returns the exit code"""
+    if args.compare:
+        regressions = compare(args.baseline, results, args.threshold, args.time_floor, args.memory_floor)
+        if regressions:
+            print(f'{len(regressions)} benchmarks worse than the baseline by more than {args.threshold:.0%}')
+            return 1
+    else:
+        for name, value in sorted(results.items(), key=lambda item: is_memory(item[0])):
+            print(f'{name:60s} {_format(name, value)}')
+    if args.save:
+        save(args.baseline, results)
+    return 0
@@ -0,0 +1,79 @@
+"""Per-message against batched processing of SingleTokenFallbackClassifier
+
+Generates synthetic messages with a random number of tokens (some of a single character) and intent
+confidences mostly above the threshold, as those of a trained model. One copy is processed message by
+message and another copy in a batch, the script checks that both give the same result and reports the
+speedup. Run from the repository root:
+
+    python3 scripts/benchmarks/fallback_batch.py --messages 10000 50000
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from rasa.nlu.tokenizers.tokenizer import Token
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.constants import INTENT, INTENT_NAME_KEY, INTENT_RANKING_KEY, PREDICTED_CONFIDENCE_KEY
+
+from fallback import SingleTokenFallbackClassifier
+
+CONFIG = {'threshold': 0.95, 'intent_name': 'single_word', 'maximum_num_tokens': 1}
+
+
+def synthetic_messages(num_messages, rng):
+    messages = []
+    for _ in range(num_messages):
+        words = [rng.choice(['?', 'a', 'wohnung', 'kinder', 'beratung', 'bfz', 'x'])
+                 for _ in range(rng.choice([1, 1, 2, 3, 5, 10, 20]))]
+        tokens = []
+        start = 0
+        for w in words:
+            tokens.append(Token(w, start))
+            start += len(w) + 1
+        confidence = rng.uniform(0.95, 1.0) if rng.random() < 0.7 else rng.random()
+        intent = {INTENT_NAME_KEY: 'faq', PREDICTED_CONFIDENCE_KEY: confidence}
+        messages.append(Message(data={'text': ' '.join(words), 'text_tokens': tokens,
+                                      INTENT: intent, INTENT_RANKING_KEY: [dict(intent)]}))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched processing of SingleTokenFallbackClassifier')
+    parser.add_argument('--messages', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    classifier = SingleTokenFallbackClassifier(CONFIG)
+    rng = random.Random(args.seed)
+    results = {}
+    for n in args.messages:
+        messages = synthetic_messages(n, rng)
+        single, batch = copy.deepcopy(messages), copy.deepcopy(messages)
+
+        start = time.perf_counter()
+        for m in single:
+            classifier.process(m)
+        single_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        classifier.process_batch(batch)
+        batch_seconds = time.perf_counter() - start
+
+        for a, b in zip(single, batch):
+            assert a.data[INTENT] == b.data[INTENT] and a.data[INTENT_RANKING_KEY] == b.data[INTENT_RANKING_KEY], \
+                'Batched processing differs from per-message processing'
+
+        results[n] = {'single_seconds': single_seconds, 'batch_seconds': batch_seconds,
+                      'speedup': single_seconds / batch_seconds}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Conflicting synonyms of the importer: the inverted index of `filter_keywords` against the quadratic check
+
+Generates synthetic keyword sheets with `synthetic_spreadsheet.py`, logs their conflicts with
+`filter_keywords` and with the check it used to run (the synonyms of every filter against those of all
+the other filters), checks that both log the same conflicts and reports the speedup. The quadratic check
+takes minutes beyond a few thousand keywords. Run from the repository root:
+
+    python3 scripts/benchmarks/filter_conflicts.py --keywords 1000 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import import_questions as iq
+import synthetic_spreadsheet
+
+CONFLICT_MESSAGE = 'Synonyms, context {}, keyword {}, found conflicting synonyms: {}, please solve the conflicts in the filter keywords sheet'
+
+
+def filter_rows(keywords, synonyms, conflicts, seed):
+    rows, _ = synthetic_spreadsheet.keyword_sheet(random.Random(seed), keywords, synonyms, conflicts)
+    return iq.get_filter_keyword_sheet(iq.SnapshotSpreadsheet({iq.SHEET_FILTER_KEYWORDS: rows}))
+
+
+class Messages(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def logged_conflicts(rows):
+    """Conflict lines of the detailed log of `filter_keywords`"""
+    handler = Messages()
+    iq.logger.addHandler(handler)
+    try:
+        iq.filter_keywords(rows)
+    finally:
+        iq.logger.removeHandler(handler)
+    return sorted(m for m in handler.messages if 'found conflicting synonyms' in m)
+
+
+def quadratic_conflicts(rows):
+    """Conflict lines of the overlap check `filter_keywords` used to run"""
+    gs = iq.group_by_column(rows, 'context')
+    filters_with_key = [row._replace(key=rows[0].key, context=context, valid=rows[0].key and context)
+                        for context, rows in gs.items()
+                        for row in rows[1:]
+                        if row.keyword]
+
+    lines = []
+    for c in set([f.context for f in filters_with_key]):
+        for f in [f for f in filters_with_key if f.context == c]:
+            syns = [f.keyword] + f.synonyms
+            other_syns = [syn
+                          for of in filters_with_key if of.valid and of.keyword != f.keyword
+                          for syn in [of.keyword] + of.synonyms]
+            overlap = [s for s in syns if s in other_syns]
+            if overlap:
+                lines.append(CONFLICT_MESSAGE.format(c, f.keyword, overlap))
+    return sorted(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the conflicting synonym check of the importer')
+    parser.add_argument('--keywords', type=int, nargs='+', default=[1000, 2000])
+    parser.add_argument('--synonyms', type=int, default=iq.NUM_SYNONYMS, help='Number of synonyms per keyword')
+    parser.add_argument('--conflicts', type=float, default=0.02, help='Share of the synonyms also used by another filter')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    for n in args.keywords:
+        rows = filter_rows(n, args.synonyms, args.conflicts, args.seed)
+
+        start = time.perf_counter()
+        old = quadratic_conflicts(rows)
+        quadratic_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = logged_conflicts(rows)
+        index_seconds = time.perf_counter() - start
+
+        if old != new:
+            sys.exit(f'Different conflicts with {n} keywords, only logged by the quadratic check: {sorted(set(old) - set(new))[:3]}, '
+                     f'only logged by filter_keywords: {sorted(set(new) - set(old))[:3]}')
+
+        results[n] = {'conflicts': len(new), 'quadratic_seconds': quadratic_seconds, 'index_seconds': index_seconds,
+                      'speedup': quadratic_seconds / index_seconds}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Micro-benchmarks of the hot paths of the action server and the NLU extensions
+
+Covers `ActionFilterResults._template_filters`, `_bfz_url`, `_format`, the synonym resolution of `run`
+and `SingleTokenFallbackClassifier.process` / `_should_fallback`, with synthetic inputs from one to
+thousands of filters (or tokens). All the benchmarks are run `--rounds` times one after the other and the
+best time of each is kept, so that a slow moment of the machine only affects one round. Calls of a few
+microseconds vary by up to one, `--compare` ignores slowdowns of less than 1us. The baseline is recorded
+with Rasa installed, for the NLU extension benchmarks. Run from the repository root:
+
+    python3 scripts/benchmarks/hot_paths.py --save       # record a new baseline
+    python3 scripts/benchmarks/hot_paths.py --compare    # fail when slower than the baseline
+"""
+import argparse
+import functools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import baseline
+
+SIZES = [1, 10, 100, 1000, 5000]
+CONTEXTS = ['_topic', '_targetgroup', '_language', '_searchterms', '_quarter']
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'hot_paths.json')
+TIME_FLOOR = 1e-6
+# Runs of every benchmark per round, the rounds spread them over the whole run
+time_call = functools.partial(baseline.time_call, repeat=2)
+
+
+def synthetic_action(num_filters, rng):
+    from data.actions import ActionFilterResults
+    from data.lexicon import FilterLexicon, FilterRecord
+
+    filters = {}
+    stems = {}
+    for i in range(num_filters):
+        context = CONTEXTS[i % len(CONTEXTS)]
+        filters[f'filter_{i}'] = FilterRecord(f'Filter {i}', rng.choice('cus'), context, context == '_searchterms')
+        stems[f'synonym{i}'] = f'filter_{i}'
+
+    action = ActionFilterResults.__new__(ActionFilterResults)
+    action.lexicon = FilterLexicon(filters, stems)
+    return action
+
+
+def action_benchmarks(rng):
+    results = {}
+    for n in SIZES:
+        action = synthetic_action(n, rng)
+        filters = list(action.lexicon)
+        # Half filter ids, half synonyms left for stem resolution
+        raw_filters = [f if i % 2 else f'synonym{i}' for i, f in enumerate(filters)]
+
+        results[f'action._format[{n}]'] = time_call(lambda: action._format(filters))
+        results[f'action._template_filters[{n}]'] = time_call(lambda: action._template_filters(filters))
+        results[f'action._bfz_url[{n}]'] = time_call(lambda: action._bfz_url(filters))
+        results[f'action._resolve_filters[{n}]'] = time_call(lambda: action._resolve_filters(raw_filters))
+    return results
+
+
+def synthetic_message(num_tokens):
+    from rasa.nlu.tokenizers.tokenizer import Token
+    from rasa.shared.nlu.training_data.message import Message
+
+    words = [f'wort{i}' for i in range(num_tokens)]
+    tokens = []
+    start = 0
+    for w in words:
+        tokens.append(Token(w, start))
+        start += len(w) + 1
+    return Message(data={'text': ' '.join(words), 'text_tokens': tokens})
+
+
+def fallback_benchmarks():
+    from rasa.shared.nlu.constants import INTENT, INTENT_NAME_KEY, INTENT_RANKING_KEY, PREDICTED_CONFIDENCE_KEY
+    from fallback import SingleTokenFallbackClassifier
+
+    classifier = SingleTokenFallbackClassifier({'threshold': 0.95, 'intent_name': 'single_word', 'maximum_num_tokens': 1})
+
+    def predicted(message, confidence):
+        # process modifies the intent and ranking, reset them to the classifier output before each call
+        intent = {INTENT_NAME_KEY: 'faq', PREDICTED_CONFIDENCE_KEY: confidence}
+        message.data[INTENT] = intent
+        message.data[INTENT_RANKING_KEY] = [intent]
+        return message
+
+    results = {}
+    for n in SIZES:
+        message = synthetic_message(n)
+        for confidence in [0.5, 0.99]:
+            predicted(message, confidence)
+            results[f'fallback._should_fallback[{n},{confidence}]'] = time_call(
+                lambda: classifier._should_fallback(message))
+            results[f'fallback.process[{n},{confidence}]'] = time_call(
+                lambda: classifier.process(predicted(message, confidence)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the action and NLU extension hot paths')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of runs of all the benchmarks')
+    baseline.add_arguments(parser, DEFAULT_BASELINE, TIME_FLOOR)
+    args = parser.parse_args()
+
+    results = {}
+    nlu = True
+    for _ in range(args.rounds):
+        round_results = action_benchmarks(random.Random(0))
+        if nlu:
+            try:
+                round_results.update(fallback_benchmarks())
+            except ImportError as e:
+                print(f'Skipping the NLU extension benchmarks, Rasa is not available: {e}')
+                nlu = False
+        for name, seconds in round_results.items():
+            results[name] = min(results.get(name, seconds), seconds)
+
+    sys.exit(baseline.report(args, results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Time and peak memory of the stages of the question import on synthetic spreadsheets
+
+Generates a spreadsheet of every size with `synthetic_spreadsheet.py` and imports it offline, each
+import in a new process so that no cache of an earlier import is reused. The time of a stage is the median
+of `--repeat` imports. Peak memory is measured by another import with memory tracing, which slows the
+import down. Stage times are in milliseconds and the shortest stages vary by tens of them, so `--compare`
+ignores slowdowns of less than 20ms and memory growth of less than 0.1MB, and by default flags slowdowns
+of more than 50%. FAQ, chitchat and phrases are written after the filter questions (`--sequential`), so
+that the stages don't compete for the processor. Run from the repository root:
+
+    python3 scripts/benchmarks/import_scaling.py --save       # record a new baseline
+    python3 scripts/benchmarks/import_scaling.py --compare    # fail when slower than the baseline
+    python3 scripts/benchmarks/import_scaling.py --sizes small medium
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import baseline
+import import_questions as iq
+import synthetic_spreadsheet
+
+# Number of question rows and filter keywords of every size
+SIZES = {
+    'small': (1000, 200),
+    'medium': (10000, 2000),
+    'large': (50000, 10000),
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'import_scaling.json')
+# Stage times vary by a third from one import to the next on a shared machine, the comparison is meant to
+# catch stages scaling worse with the size of the spreadsheet, which shows as multiples of their time
+THRESHOLD = 0.5
+TIME_FLOOR = 0.02
+MEMORY_FLOOR = 0.1
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the question import by spreadsheet size')
+    parser.add_argument('--sizes', type=str, nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--synonyms', type=int, default=iq.NUM_SYNONYMS, help='Number of synonyms per keyword')
+    parser.add_argument('--processes', type=int, default=1, help='Processes of the import, see import_questions.py')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of imports timed per size')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure the peak memory of the stages')
+    baseline.add_arguments(parser, DEFAULT_BASELINE, TIME_FLOOR, MEMORY_FLOOR, THRESHOLD)
+    return parser.parse_args()
+
+
+def _import(conn, argv, trace_memory):
+    args = iq.get_args(argv)
+    # The import traces memory when a timing report is requested, the report is not saved here
+    args.timing_report = trace_memory
+    _, report = iq.run(args)
+    conn.send(report.stages)
+
+
+def import_stages(snapshot, processes, trace_memory):
+    """Seconds and peak memory of the stages of the import of `snapshot`, imported in a new process"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        argv = ['--offline', '--snapshot', snapshot, '--output-dir', output_dir, '--seed', '1', '--sequential',
+                '--processes', str(processes)]
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.get_context('spawn').Process(target=_import, args=(sender, argv, trace_memory))
+        process.start()
+        # Only the child holds the sending end, so that its exit ends the wait
+        sender.close()
+        try:
+            stages = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError(f'Import of {snapshot} failed with exit code {process.exitcode}')
+        process.join()
+        return stages
+
+
+def benchmark(args, size, snapshot):
+    questions, keywords = SIZES[size]
+    synthetic_spreadsheet.generate(questions, keywords, args.synonyms).save(snapshot)
+
+    seconds = {}
+    for _ in range(args.repeat):
+        stages = import_stages(snapshot, args.processes, trace_memory=False)
+        for stage, timing in stages.items():
+            seconds.setdefault(f'import[{size}].{stage}', []).append(timing['seconds'])
+        seconds.setdefault(f'import[{size}].total', []).append(sum(timing['seconds'] for timing in stages.values()))
+    results = {name: statistics.median(values) for name, values in seconds.items()}
+
+    if not args.no_memory:
+        for stage, timing in import_stages(snapshot, args.processes, trace_memory=True).items():
+            results[f'import[{size}].{stage}.peak_memory_mb'] = timing['peak_memory_mb']
+    return results
+
+
+def main():
+    args = get_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            print(f'Importing the {size} spreadsheet', file=sys.stderr)
+            results.update(benchmark(args, size, os.path.join(tmp, f'{size}.json')))
+    sys.exit(baseline.report(args, results))
+
+
+if __name__ == '__main__':
+    main()
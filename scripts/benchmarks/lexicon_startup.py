@@ -0,0 +1,82 @@
+"""Startup time and memory of loading the filter lexicon in the action server
+
+Compares loading the filter mapping with pandas (as the action server used to do) against loading
+the precompiled lexicon, and against mapping the lexicon file shared by the workers of
+`scripts/run_action_server.py`. Every measurement runs in a fresh interpreter, so imports are included.
+
+Run from the repository root:
+
+    python3 scripts/benchmarks/lexicon_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from data.lexicon import FILTER_LEXICON_PATH, FilterLexicon, write_mapped_lexicon
+
+PANDAS = '''
+import pandas as pd
+df = pd.read_csv('data/generated/filter_questions/entities/filter_mapping.csv')
+filter_mapping = df.set_index('filter').to_dict()
+df = pd.read_csv('data/generated/filter_questions/entities/filter_synonyms.csv')
+synonym_to_filter = df.set_index('synonym').to_dict()['filter']
+'''
+
+LEXICON = '''
+from data.lexicon import FilterLexicon
+lexicon = FilterLexicon.load('data/generated/filter_questions/entities/filter_lexicon.json')
+'''
+
+MAPPED = '''
+from data.lexicon import MappedFilterLexicon
+lexicon = MappedFilterLexicon(sys.argv[2])
+'''
+
+MEASURE = '''
+import resource, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def measure(code, repeat, *argv):
+    runs = []
+    for _ in range(repeat):
+        # nltk is imported in all cases, the action server needs it for stemming
+        out = subprocess.run([sys.executable, '-c', MEASURE, 'import nltk.stem\n' + code, *argv],
+                             check=True, capture_output=True, text=True).stdout.split()
+        runs.append((float(out[0]), int(out[1])))
+    return {
+        'seconds': statistics.median(r[0] for r in runs),
+        'max_rss_kb': statistics.median(r[1] for r in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading the filter lexicon')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mapped_path = os.path.join(tmp, 'filter_lexicon.bin')
+        write_mapped_lexicon(FilterLexicon.load(FILTER_LEXICON_PATH), mapped_path)
+        results = {
+            'pandas': measure(PANDAS, args.repeat),
+            'lexicon': measure(LEXICON, args.repeat),
+            'mapped': measure(MAPPED, args.repeat, mapped_path),
+        }
+    print(json.dumps(results, indent=2))
+    print(f"Speedup {results['pandas']['seconds'] / results['lexicon']['seconds']:.1f}x, "
+          f"memory saved {(results['pandas']['max_rss_kb'] - results['lexicon']['max_rss_kb']) / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
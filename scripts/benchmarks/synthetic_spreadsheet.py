@@ -0,0 +1,186 @@
+"""Synthetic question spreadsheet of a given size, as a snapshot importable with `--offline --snapshot`
+
+Generates the `Fragenkatalog`, `Schlüsselwörter` and `Imported Phrases` sheets in the layout of the
+real spreadsheet:
+ * filter keywords in groups per context, each filter with a keyword and `--synonyms` synonyms,
+   a share of them also used by another filter (conflicts) and some rows without filter ID,
+ * FAQ and chitchat intents with their variants and answers,
+ * filter questions with `[bracketed]` synonyms, with untagged synonyms left for automatic tagging,
+   with unknown tags and without any synonym,
+ * phrases with several variants.
+
+The same arguments and seed give the same snapshot. Run from the repository root:
+
+    python3 scripts/benchmarks/synthetic_spreadsheet.py --questions 50000 --keywords 10000 --synonyms 15 \\
+        --output spreadsheet_snapshots/synthetic.json
+    python3 scripts/import_questions.py --offline --snapshot spreadsheet_snapshots/synthetic.json --output-dir out
+"""
+import argparse
+import os
+import random
+import sys
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import import_questions as iq
+
+# Filter contexts of the keywords sheet, with their key in the URL of the results and share of the filters
+FILTER_CONTEXTS = [('_topic', 'c', 0.5), ('_targetgroup', 't', 0.1), ('_language', 'u', 0.1),
+                   ('_quarter', 'q', 0.1), ('_searchterms', 's', 0.2)]
+# Share of the questions in each question context, the rows of an intent are its question and variants
+QUESTION_CONTEXTS = [('/bfz', 0.25), ('/specialitems', 0.05), ('/chitchat', 0.1), ('/content', 0.6)]
+
+SYLLABLES = ['an', 'ar', 'be', 'ber', 'bil', 'dung', 'de', 'der', 'ein', 'fa', 'fe', 'ge', 'gen', 'hal', 'heit',
+             'hil', 'kin', 'kurs', 'la', 'le', 'lie', 'mi', 'mit', 'na', 'ne', 'or', 'pfle', 're', 'sa', 'schu',
+             'spra', 'stel', 'sucht', 'ta', 'te', 'to', 'tung', 'un', 've', 'wo', 'woh', 'zu']
+
+TAGGED_QUESTIONS = ['Gibt es Angebote zu [{0}]?', 'Ich suche [{0}] in meiner Nähe', 'Wo finde ich Hilfe bei [{0}]?',
+                    'Welche Beratung gibt es für [{0}]', 'Gibt es [{0}] auf [{1}]?', 'Ich brauche [{0}] und [{1}]']
+UNTAGGED_QUESTIONS = ['Wo finde ich {0}?', 'Ich brauche {0}', 'Gibt es {0}', 'Hilfe bei {0}, bitte.']
+UNKNOWN_TAG_QUESTIONS = ['Ich suche [{0}]', 'Gibt es [{0}] und [{1}]?']
+NO_KEYWORD_QUESTIONS = ['Hallo, wie geht es?', 'Können Sie mir helfen', 'Danke für die Hilfe']
+# Share of the filter questions of each kind, the rest are tagged
+UNTAGGED_SHARE = 0.3
+UNKNOWN_TAG_SHARE = 0.05
+NO_KEYWORD_SHARE = 0.05
+# Share of the filters without filter ID, discarded by the import
+INVALID_FILTER_SHARE = 0.01
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Generate a synthetic question spreadsheet snapshot')
+    parser.add_argument('--questions', type=int, default=50000, help='Number of question rows')
+    parser.add_argument('--keywords', type=int, default=10000, help='Number of filter keywords')
+    parser.add_argument('--synonyms', type=int, default=iq.NUM_SYNONYMS, help='Number of synonyms per keyword')
+    parser.add_argument('--phrases', type=int, default=500, help='Number of phrases')
+    parser.add_argument('--conflicts', type=float, default=0.02, help='Share of the synonyms also used by another filter')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, required=True, help='Path of the snapshot')
+    return parser.parse_args()
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+class Words:
+    """Unique German-looking words and word pairs, for keywords and synonyms"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.used = set()
+
+    def __call__(self):
+        while True:
+            w = word(self.rng)
+            if self.rng.random() < 0.1:
+                w += ' ' + word(self.rng)
+            if w not in self.used:
+                self.used.add(w)
+                return w
+
+
+def keyword_sheet(rng, keywords, synonyms, conflicts):
+    """Rows of the keywords sheet and the keywords with their synonyms by context"""
+    words = Words(rng)
+    header = [iq.COL_FILTER_CONTEXT, iq.COL_KEY, iq.COL_FILTER, iq.COL_KEYWORD] + \
+             [iq.COL_SYNONYM.replace('_NUMBER_', str(i + 1)) for i in range(synonyms)]
+    rows = [header]
+    filters = OrderedDict()
+    all_synonyms = []
+
+    for context, key, share in FILTER_CONTEXTS:
+        rows.append([context, key, '', 'Header'] + [''] * synonyms)
+        filters[context] = []
+        for i in range(max(1, round(keywords * share))):
+            keyword = words().capitalize()
+            syns = [words() for _ in range(synonyms)]
+            for n in range(len(syns)):
+                if all_synonyms and rng.random() < conflicts:
+                    syns[n] = rng.choice(all_synonyms)
+            all_synonyms += syns
+
+            filter_id = '' if rng.random() < INVALID_FILTER_SHARE else f'{context[1:]}-{i}'
+            rows.append(['', '', filter_id, keyword] + syns + [''] * (synonyms - len(syns)))
+            if filter_id:
+                filters[context].append([keyword] + syns)
+            if rng.random() < 0.01:
+                # Cosmetic empty rows
+                rows.append([''] * len(header))
+    return rows, filters
+
+
+def answer(rng, n):
+    text = f'Antwort {n}: ' + ' '.join(word(rng) for _ in range(rng.randint(5, 30))) + '.'
+    return text + (f' [Mehr dazu](https://example.org/{n})' if rng.random() < 0.3 else '')
+
+
+def filter_question(rng, synonyms):
+    kind = rng.random()
+    if kind < NO_KEYWORD_SHARE:
+        return rng.choice(NO_KEYWORD_QUESTIONS)
+    if kind < NO_KEYWORD_SHARE + UNKNOWN_TAG_SHARE:
+        return rng.choice(UNKNOWN_TAG_QUESTIONS).format(word(rng), word(rng))
+    if kind < NO_KEYWORD_SHARE + UNKNOWN_TAG_SHARE + UNTAGGED_SHARE:
+        return rng.choice(UNTAGGED_QUESTIONS).format(rng.choice(synonyms))
+    return rng.choice(TAGGED_QUESTIONS).format(rng.choice(synonyms), rng.choice(synonyms))
+
+
+def question_sheet(rng, questions, filters):
+    header = [iq.COL_CONTEXT, iq.COL_INTENT, iq.COL_EXAMPLE, iq.COL_VARIANTS] + iq.COL_ANSWERS
+    rows = [header]
+    empty = [''] * len(header)
+    # Filter questions mostly use a few synonyms of a filter, like the real ones
+    synonyms = [syn for context in filters.values() for syns in context for syn in syns[:3]]
+
+    intents = 0
+    for context, share in QUESTION_CONTEXTS:
+        rows.append([context] + empty[1:])
+        n = max(1, round(questions * share))
+        if context == '/content':
+            rows += [['', '', '', filter_question(rng, synonyms)] + empty[4:] for _ in range(n)]
+            continue
+
+        while n > 0:
+            variants = min(n - 1, rng.randint(2, 8))
+            answers = [answer(rng, intents) for _ in range(rng.randint(1, len(iq.COL_ANSWERS)))]
+            rows.append(['', f'/intent_{intents}', f'Frage {intents} zu {word(rng)}?', ''] + answers
+                        + [''] * (len(iq.COL_ANSWERS) - len(answers)))
+            rows += [['', '', '', f'Variante {v} der Frage {intents} zu {word(rng)}?'] + empty[4:] for v in range(variants)]
+            intents += 1
+            n -= variants + 1
+    return rows
+
+
+def phrase_sheet(rng, phrases):
+    rows = [[iq.COL_PHRASE_KEY] + iq.COL_PHRASE_ANSWERS]
+    keys = [iq.YESNO_PHRASES] + [f'/phrase_{i}' for i in range(phrases - 1)]
+    for key in keys:
+        for variant in range(rng.randint(1, 3)):
+            answers = [answer(rng, i) for i in range(rng.randint(1, len(iq.COL_PHRASE_ANSWERS)))]
+            rows.append([key if variant == 0 else ''] + answers + [''] * (len(iq.COL_PHRASE_ANSWERS) - len(answers)))
+    return rows
+
+
+def generate(questions=50000, keywords=10000, synonyms=iq.NUM_SYNONYMS, phrases=500, conflicts=0.02, seed=0):
+    """Synthetic spreadsheet with about `questions` question rows and `keywords` filter keywords"""
+    rng = random.Random(seed)
+    keyword_rows, filters = keyword_sheet(rng, keywords, synonyms, conflicts)
+    sheets = OrderedDict([
+        (iq.SHEET_QUESTIONS, question_sheet(rng, questions, filters)),
+        (iq.SHEET_FILTER_KEYWORDS, keyword_rows),
+        (iq.SHEET_PHRASES, phrase_sheet(rng, phrases)),
+    ])
+    return iq.SnapshotSpreadsheet(sheets, f'synthetic-{questions}-{keywords}-{synonyms}', seed)
+
+
+def main():
+    args = get_args()
+    spreadsheet = generate(args.questions, args.keywords, args.synonyms, args.phrases, args.conflicts, args.seed)
+    spreadsheet.save(args.output)
+    print(f'Saved {", ".join(f"{len(rows)} rows of {name}" for name, rows in spreadsheet.sheets.items())} to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
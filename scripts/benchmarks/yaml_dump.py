@@ -0,0 +1,114 @@
+"""YAML rendering of the importer: `yaml.dump` to a string against the streaming emitter
+
+Generates synthetic FAQ, filter question and domain documents shaped like the generated files, renders
+them as the importer used to (pure Python dumper, whole document in a string written to the file) and
+with `scripts/yaml_emitter.py`, checks that the files are identical and reports the speedup.
+Run from the repository root:
+
+    python3 scripts/benchmarks/yaml_dump.py --questions 1000 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import yaml
+
+import yaml_emitter
+
+WORDS = ['Beratung', 'Kinder', 'Wohnung', 'in', 'der', 'Nähe', 'für', 'Frauen', 'Arbeit', 'Deutschkurs',
+         'wie', 'kann', 'ich', 'finden', 'Schule', 'Familie', 'Termin', 'kostenlos', 'Ärztin', 'Sprache']
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def synthetic_documents(num_questions, rng):
+    faq = OrderedDict({
+        'version': '2.0',
+        'nlu': [OrderedDict({'intent': f'faq/bfz_{i}',
+                             'examples': '\n'.join(f'- {sentence(rng, 8)}?' for _ in range(5))})
+                for i in range(num_questions)],
+        'responses': OrderedDict({f'utter_faq/bfz_{i}': [{'text': '\n\n'.join(sentence(rng, 25) for _ in range(3))}]
+                                  for i in range(num_questions)}),
+    })
+    filter_questions = OrderedDict({
+        'version': '2.0',
+        'nlu': [OrderedDict({'intent': 'filter_question',
+                             'examples': '\n'.join(f'- {sentence(rng, 4)} [{rng.choice(WORDS)}](filter)?'
+                                                   for _ in range(num_questions * 5))})],
+    })
+    domain = OrderedDict({
+        'version': '2.0',
+        'responses': OrderedDict({f'utter_phrase_{i}': [OrderedDict({'text': sentence(rng, 12),
+                                                                     'buttons': [OrderedDict({'title': 'Ja', 'payload': '/affirm'}),
+                                                                                 OrderedDict({'title': 'Nein', 'payload': '/deny'})]})]
+                                  for i in range(num_questions // 10)}),
+    })
+    return {'faq': faq, 'filter_questions': filter_questions, 'domain': domain}
+
+
+# Representers of the importer before the streaming emitter
+class PreviousDumper(yaml.Dumper):
+    pass
+
+
+def previous_str_presenter(dumper, data):
+    if len(data.splitlines()) > 1:  # check for multiline string
+        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_scalar('tag:yaml.org,2002:str', data)
+
+
+PreviousDumper.add_representer(OrderedDict, yaml_emitter.ordered_dict_presenter)
+PreviousDumper.add_representer(str, previous_str_presenter)
+
+
+def dump_string(doc, path):
+    with open(path, 'w') as f:
+        f.write(yaml.dump(doc, Dumper=PreviousDumper, allow_unicode=True))
+
+
+def dump_stream(doc, path):
+    with open(path, 'w') as f:
+        yaml_emitter.dump(doc, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the YAML rendering of the importer')
+    parser.add_argument('--questions', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {'c_emitter': yaml_emitter.CDumper is not None}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.questions:
+            for name, doc in synthetic_documents(n, rng).items():
+                old, new = os.path.join(tmp, 'old.yml'), os.path.join(tmp, 'new.yml')
+
+                start = time.perf_counter()
+                dump_string(doc, old)
+                string_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                dump_stream(doc, new)
+                stream_seconds = time.perf_counter() - start
+
+                with open(old, 'rb') as a, open(new, 'rb') as b:
+                    assert a.read() == b.read(), f'Different output for {name} with {n} questions'
+
+                results[f'{name}_{n}'] = {'string_seconds': string_seconds, 'stream_seconds': stream_seconds,
+                                          'speedup': string_seconds / stream_seconds}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""NLU evaluation of a model with the test examples split across processes
+
+Each worker process loads the NLU model once and parses a contiguous shard of the test examples, in
+batches run through the pipeline component by component: components with a `process_batch` method (e.g.
+`fallback.SingleTokenFallbackClassifier`) process a whole batch at once. The results of the shards are
+merged in order and evaluated as `rasa test nlu` does, writing the same intent, response selection and
+entity reports. The script exits with status 1 if any example is mispredicted.
+The speedup is the time one process would take to load the model and parse all the examples, measured
+by the workers, over the wall time of the evaluation.
+
+Run from the repository root:
+
+    python3 scripts/evaluate_nlu.py --nlu tests/test_nlu.yml data/generated --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import model_cache
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Evaluate the NLU model on test examples with several processes')
+    parser.add_argument('--model', type=str, help='Model archive or directory of models, by default the model of the current content or the latest one')
+    parser.add_argument('--nlu', type=str, nargs='+', default=['tests/test_nlu.yml'], help='Files or directories of test examples')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes parsing the test examples')
+    parser.add_argument('--batch-size', type=int, default=256, help='Number of test examples parsed at once by a worker')
+    parser.add_argument('--out', type=str, default='results', help='Directory of the reports')
+    parser.add_argument('--successes', action='store_true', help='Write the correct predictions to the reports')
+    parser.add_argument('--no-plot', action='store_true', help='Do not plot confusion matrices and histograms')
+    parser.add_argument('--report', type=str, help='Save the timings and number of errors as JSON')
+    return parser.parse_args()
+
+
+def default_model():
+    path = model_cache.model_path(model_cache.MODELS_DIR, model_cache.fingerprint())
+    return path if os.path.exists(path) else model_cache.MODELS_DIR
+
+
+def load_test_data(paths, language):
+    from rasa.shared.nlu.training_data.loading import load_data
+
+    data = load_data(paths[0], language)
+    return data.merge(*[load_data(path, language) for path in paths[1:]])
+
+
+def shards(n, workers):
+    """Contiguous ranges of examples, so that results are merged in the order of the examples"""
+    size, extra = divmod(n, workers)
+    bounds = [i * size + min(i, extra) for i in range(workers + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+########################################
+# Workers
+########################################
+
+# Interpreter and test data of the worker process, loaded once by the initializer
+_interpreter = None
+_test_data = None
+_load_seconds = None
+_batch_size = None
+
+
+def parse_batch(interpreter, texts):
+    """Same results as `interpreter.parse(text, only_output_properties=False)` for each of the texts
+
+    Every component processes all the messages before the next one, with its `process_batch` method if it
+    has one.
+    """
+    from rasa.shared.nlu.constants import TEXT
+    from rasa.shared.nlu.training_data.message import Message
+
+    messages = []
+    for text in texts:
+        data = interpreter.default_output_attributes()
+        data[TEXT] = text or ''
+        messages.append(Message(data=data))
+    # As in Interpreter.parse, empty texts are not processed
+    parsed = [message for message, text in zip(messages, texts) if text]
+    for component in interpreter.pipeline:
+        if hasattr(component, 'process_batch'):
+            component.process_batch(parsed, **interpreter.context)
+        else:
+            for message in parsed:
+                component.process(message, **interpreter.context)
+
+    results = []
+    for message in messages:
+        output = interpreter.default_output_attributes()
+        output.update(message.as_dict(only_output_properties=False))
+        results.append(output)
+    return results
+
+
+class BatchParsedInterpreter:
+    """Interpreter for `rasa.nlu.test.get_eval_data`, parsing the texts `batch_size` at a time
+
+    `parse` must be called with the texts in the given order, as `get_eval_data` does with its examples.
+    """
+
+    def __init__(self, interpreter, texts, batch_size):
+        self.interpreter = interpreter
+        # The evaluation looks up the classifiers and extractors in the pipeline
+        self.pipeline = interpreter.pipeline
+        self.texts = texts
+        self.batch_size = batch_size
+        self._results = []
+        self._next = 0
+
+    def parse(self, text, time=None, only_output_properties=True):
+        if not self._results:
+            batch = self.texts[self._next:self._next + self.batch_size]
+            self._results = parse_batch(self.interpreter, batch)[::-1]
+        self._next += 1
+        result = self._results.pop()
+        assert result['text'] == (text or ''), 'Texts parsed out of order'
+        return result
+
+
+def _init_worker(nlu_model_dir, paths, batch_size):
+    global _interpreter, _test_data, _load_seconds, _batch_size
+    from rasa.nlu.model import Interpreter
+    from rasa.nlu.test import remove_pretrained_extractors
+
+    started = time.perf_counter()
+    _interpreter = Interpreter.load(nlu_model_dir)
+    _interpreter.pipeline = remove_pretrained_extractors(_interpreter.pipeline)
+    _test_data = load_test_data(paths, _interpreter.model_metadata.language)
+    _load_seconds = time.perf_counter() - started
+    _batch_size = batch_size
+
+
+def _evaluate_shard(shard):
+    """Evaluation results of the examples of `shard`, the entity extractors, parse and load times"""
+    from rasa.nlu.test import get_entity_extractors, get_eval_data
+    from rasa.shared.nlu.constants import TEXT
+    from rasa.shared.nlu.training_data.training_data import TrainingData
+
+    start, end = shard
+    data = TrainingData(training_examples=_test_data.nlu_examples[start:end],
+                        entity_synonyms=_test_data.entity_synonyms,
+                        regex_features=_test_data.regex_features,
+                        lookup_tables=_test_data.lookup_tables,
+                        responses=_test_data.responses)
+    started = time.perf_counter()
+    interpreter = BatchParsedInterpreter(_interpreter, [example.get(TEXT) for example in data.nlu_examples], _batch_size)
+    results = get_eval_data(interpreter, data)
+    return results, get_entity_extractors(_interpreter), time.perf_counter() - started, _load_seconds
+
+
+########################################
+# Evaluation
+########################################
+
+def count_errors(intent_results, response_selection_results, entity_results, extractors):
+    intent_errors = sum(1 for r in intent_results if r.intent_target and r.intent_target != r.intent_prediction)
+    response_errors = sum(1 for r in response_selection_results
+                          if r.intent_response_key_target and r.intent_response_key_target != r.intent_response_key_prediction)
+
+    def entities(es, extractor=None):
+        return sorted((e['start'], e['end'], e['entity']) for e in es if extractor is None or e.get('extractor') == extractor)
+
+    entity_errors = sum(1 for r in entity_results for extractor in extractors
+                        if entities(r.entity_targets) != entities(r.entity_predictions, extractor))
+    return {'intent': intent_errors, 'response_selection': response_errors, 'entity': entity_errors}
+
+
+def main():
+    args = get_args()
+
+    import rasa.model
+    from rasa.nlu.model import Metadata
+    from rasa.nlu.test import evaluate_entities, evaluate_intents, evaluate_response_selections
+
+    model = rasa.model.get_model(args.model or default_model())
+    _, nlu_model_dir = rasa.model.get_model_subdirectories(model)
+
+    # The model is only loaded by the workers, this process just splits and merges the examples
+    test_data = load_test_data(args.nlu, Metadata.load(nlu_model_dir).language)
+
+    workers = max(1, min(args.workers, len(test_data.nlu_examples)))
+    print(f'Evaluating {len(test_data.nlu_examples)} examples with {workers} workers', file=sys.stderr)
+
+    started = time.perf_counter()
+    # Workers are spawned, forking after TensorFlow is initialised is not supported
+    with multiprocessing.get_context('spawn').Pool(workers, initializer=_init_worker,
+                                                   initargs=(nlu_model_dir, args.nlu, args.batch_size)) as pool:
+        shard_results = pool.map(_evaluate_shard, shards(len(test_data.nlu_examples), workers), chunksize=1)
+    wall_seconds = time.perf_counter() - started
+
+    intent_results, response_selection_results, entity_results = [], [], []
+    for (intents, responses, entities), extractors, _, _ in shard_results:
+        intent_results += intents
+        response_selection_results += responses
+        entity_results += entities
+
+    evaluation = {'output_directory': args.out, 'successes': args.successes, 'errors': True,
+                  'disable_plotting': args.no_plot}
+    os.makedirs(args.out, exist_ok=True)
+    if intent_results:
+        evaluate_intents(intent_results, **evaluation)
+    if response_selection_results:
+        evaluate_response_selections(response_selection_results, **evaluation)
+    if any(r.entity_targets for r in entity_results):
+        evaluate_entities(entity_results, extractors, **evaluation)
+
+    errors = count_errors(intent_results, response_selection_results, entity_results, extractors)
+    load_seconds = max(load for _, _, _, load in shard_results)
+    parse_seconds = sum(seconds for _, _, seconds, _ in shard_results)
+    report = {
+        'examples': len(test_data.nlu_examples),
+        'workers': workers,
+        'wall_seconds': wall_seconds,
+        'load_seconds': load_seconds,
+        'parse_seconds': parse_seconds,
+        # Time a single process would take to load the model and parse all the examples, over the wall time
+        'speedup': (load_seconds + parse_seconds) / wall_seconds,
+        'errors': errors,
+    }
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if sum(errors.values()):
+        sys.exit(f'Prediction errors: {errors}')
+
+
+if __name__ == '__main__':
+    main()
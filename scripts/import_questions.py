@@ -1,16 +1,30 @@
 import os, re, argparse
+import multiprocessing
 from collections import namedtuple, OrderedDict, defaultdict
-import yaml
 import pandas as pd
 import random
 import logging
 import io
+import hashlib
+import json
 import datetime
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 from nltk.stem import SnowballStemmer
 
+# The emitter is next to this script, imported as `scripts.import_questions` it is in the same package
+try:
+    from . import yaml_emitter
+except ImportError:
+    import yaml_emitter
+
 import gspread
 from gspread.models import Cell
+from gspread.urls import SPREADSHEET_URL
+from gspread.utils import fill_gaps, numericise_all
 from oauth2client.service_account import ServiceAccountCredentials
 
 ########################################
@@ -28,6 +42,15 @@ FQ_CONTEXTS = ['/content']
 SHEET_QUESTIONS = 'Fragenkatalog'
 SHEET_FILTER_KEYWORDS = 'Schlüsselwörter'
 SHEET_PHRASES = 'Imported Phrases'
+SHEETS = [SHEET_QUESTIONS, SHEET_FILTER_KEYWORDS, SHEET_PHRASES]
+
+# Files written next to the generated data, where the generated files come from and which ones changed
+MANIFEST_FILE = 'import_manifest.json'
+CHANGES_FILE = 'import_changes.json'
+
+# Snapshots of the sheets, by spreadsheet revision
+SNAPSHOT_DIR = 'spreadsheet_snapshots'
+DRIVE_FILE_URL = 'https://www.googleapis.com/drive/v3/files/%s'
 
 # Columns used in the Questions Sheet
 COL_CONTEXT = 'Context'
@@ -58,112 +81,282 @@ AUTO_GENERATE_FOR_CONTEXTS =  ['_quarter', '_language', '_targetgroup', '_topic'
 # Arguments and logging
 ########################################
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description="Import Question and Answer examples from BfZ spreadsheet")
-    parser.add_argument('--client-secret', type=str, help='Path to json key file of service account', required=True)
-    parser.add_argument('--spreadsheet-url', type=str, help='URL of Google Spreadsheet containing Questions and Answers', required=True)
+    parser.add_argument('--client-secret', type=str, help='Path to json key file of service account')
+    parser.add_argument('--spreadsheet-url', type=str, help='URL of Google Spreadsheet containing Questions and Answers')
+    parser.add_argument('--snapshot-dir', type=str, help='Directory of the snapshots of the spreadsheet', default=SNAPSHOT_DIR)
+    parser.add_argument('--offline', action='store_true', help='Import from the latest snapshot (or --snapshot) without accessing the spreadsheet')
+    parser.add_argument('--snapshot', type=str, help='Path of the snapshot to import from with --offline')
     parser.add_argument('--output-dir', type=str, help='Directory name where output will be saved', required=True)
     parser.add_argument('--quiet', action='store_true')
     parser.add_argument('--detailed-logging', action='store_true')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes tagging the filter questions and generating examples')
+    parser.add_argument('--seed', type=int, help='Seed of the example generation, the same input then gives the same output')
+    parser.add_argument('--sequential', action='store_true', help='Write the FAQ, chitchat and phrases files in this process after the filter questions, instead of concurrently')
+    parser.add_argument('--timing-report', type=str, help='Path of a JSON report of the wall time and peak memory of every stage')
     parser.add_argument('--save-logs-to-spreadsheet', help='Save logs to spreadsheet, make sure there are Sheets named "Logs" and "Logs Detailed"', action='store_true')
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.offline and not (args.client_secret and args.spreadsheet_url):
+        parser.error('--client-secret and --spreadsheet-url are required unless importing --offline')
+    return args
 
-args = get_args()
 
 # Summary logger
 sum_logger = logging.getLogger('import.summary')
 sum_logger.setLevel(logging.INFO)
-summary_stream = io.StringIO()
-sum_logger.addHandler(logging.StreamHandler(summary_stream))
 
 logger = logging.getLogger('import.detailed')
 logger.setLevel(logging.INFO)
-detailed_stream = io.StringIO()
-logger.addHandler(logging.StreamHandler(detailed_stream))
 
-if not args.quiet:
-    str_handler = logging.StreamHandler()
-    str_handler.setLevel(logging.INFO)
-    sum_logger.addHandler(str_handler)
 
-if not args.quiet and args.detailed_logging:
-    str_handler = logging.StreamHandler()
-    str_handler.setLevel(logging.INFO)
-    logger.addHandler(str_handler)
+def setup_logging(args):
+    """Logs to the console and to the strings saved to the spreadsheet, returns the summary and detailed strings"""
+    summary_stream = io.StringIO()
+    sum_logger.addHandler(logging.StreamHandler(summary_stream))
 
-sum_logger.info(f'Starting Question Import {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
-logger.info(f'Starting Question Import {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+    detailed_stream = io.StringIO()
+    logger.addHandler(logging.StreamHandler(detailed_stream))
 
+    if not args.quiet:
+        str_handler = logging.StreamHandler()
+        str_handler.setLevel(logging.INFO)
+        sum_logger.addHandler(str_handler)
 
-def main():
-    spreadsheet = open_spreadsheet(args)
+    if not args.quiet and args.detailed_logging:
+        str_handler = logging.StreamHandler()
+        str_handler.setLevel(logging.INFO)
+        logger.addHandler(str_handler)
 
-    # Create directory structure
-    os.makedirs(f'{args.output_dir}/data/generated/faq', exist_ok=True)
-    os.makedirs(f'{args.output_dir}/data/generated/chitchat', exist_ok=True)
-    os.makedirs(f'{args.output_dir}/data/generated/filter_questions/entities', exist_ok=True)
+    return summary_stream, detailed_stream
 
-    # Dump FAQ NLU data
-    question_rows = get_question_sheet(spreadsheet)
-    with open(f'{args.output_dir}/data/generated/faq/nlu.yml', 'w') as f:
-        faq = questions_answers_nlu_data(QNA_CONTEXTS, question_rows, 'faq')
-        f.write(yaml.dump(faq, allow_unicode=True))
 
-    question_rows = get_question_sheet(spreadsheet)
-    with open(f'{args.output_dir}/data/generated/chitchat/nlu.yml', 'w') as f:
-        faq = questions_answers_nlu_data(CHITCHAT_CONTEXTS, question_rows, 'chitchat')
-        f.write(yaml.dump(faq, allow_unicode=True))
+def main(argv=None):
+    args = get_args(argv)
+    summary_stream, detailed_stream = setup_logging(args)
 
-    filter_rows = get_filter_keyword_sheet(spreadsheet)
-    filter_rows = filter_keywords(args, filter_rows)
+    sum_logger.info(f'Starting Question Import {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+    logger.info(f'Starting Question Import {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
 
-    filters_df(filter_rows).to_csv(f'{args.output_dir}/data/generated/filter_questions/entities/filter_mapping.csv', index=False)
-    synonyms_df(filter_rows).to_csv(f'{args.output_dir}/data/generated/filter_questions/entities/filter_synonyms.csv', index=False)
+    spreadsheet, report = run(args)
 
-    with open(f'{args.output_dir}/data/generated/filter_questions/entities/nlu.yml', 'w') as f:
-        nlu = filters_nlu_data(filter_rows)
-        f.write(yaml.dump(nlu, allow_unicode=True))
+    if args.timing_report:
+        report.save(args.timing_report)
 
-    synonyms = make_synonyms(filter_rows)
-    qs = filter_questions_nlu_data(question_rows, synonyms)
-    new_qs = generate_examples(qs, synonyms, filter_rows)
-    log_synonyms_without_examples(qs + new_qs, filter_rows)
-    log_invalid_questions(qs)
-    log_generated_questions(new_qs)
-    nlu = filter_questions_yaml(qs + new_qs)
-
-    with open(f'{args.output_dir}/data/generated/filter_questions/nlu.yml', 'w') as f:
-        f.write(yaml.dump(nlu, allow_unicode=True))
-
-    phrases = get_phrases(spreadsheet)
-    with open(f'{args.output_dir}/data/generated/domain.yml', 'w') as f:
-        nlu = phrase_utterances(phrases)
-        f.write(yaml.dump(nlu, allow_unicode=True))
-
-    if args.save_logs_to_spreadsheet:
+    if args.save_logs_to_spreadsheet and spreadsheet is None:
+        sum_logger.info('WARNING not saving logs to the spreadsheet when importing offline')
+    elif args.save_logs_to_spreadsheet:
         sum_logger.info('End of import\n')
         logger.info('End of import\n')
         save_logs_to_sheet(spreadsheet, 'Logs', summary_stream.getvalue())
         save_logs_to_sheet(spreadsheet, 'Logs Detailed', detailed_stream.getvalue())
 
 
+########################################
+# Pipeline
+########################################
+
+# The stages of the import, each can be run on its own with the output of the previous ones:
+#   fetch:             args -> spreadsheet (None offline), snapshot of the sheets
+#   normalise:         snapshot -> SheetRows
+#   filter keywords:   SheetRows.keywords -> filter rows
+#   tag questions:     SheetRows.questions, filter rows -> synonyms, tagged filter questions
+#   generate examples: tagged filter questions, synonyms, filter rows -> generated filter questions
+#   emit:              all of the above -> files in the output directory
+# The FAQ, chitchat and phrases files only depend on the normalised rows, they are emitted in other
+# processes while the filter questions go through the later stages.
+
+# Rows of the sheets read by the import
+SheetRows = namedtuple('SheetRows', 'questions keywords phrases')
+
+
+def run(args):
+    """Runs the import with the command line arguments `args`, returns the spreadsheet and the timing report"""
+    report = TimingReport(trace_memory=bool(args.timing_report))
+
+    with report.stage('fetch'):
+        spreadsheet, sheets = fetch(args)
+
+    with report.stage('normalise'):
+        rows = normalise(sheets)
+
+    artifacts = ArtifactWriter(args.output_dir)
+    branches = [
+        ('emit faq', emit_questions_answers, rows.questions, QNA_CONTEXTS, 'faq'),
+        ('emit chitchat', emit_questions_answers, rows.questions, CHITCHAT_CONTEXTS, 'chitchat'),
+        ('emit phrases', emit_phrases, rows.phrases),
+    ]
+
+    if args.sequential:
+        futures = []
+    else:
+        pool = ProcessPoolExecutor(len(branches))
+        futures = [pool.submit(run_branch, args.output_dir, report.trace_memory, *branch) for branch in branches]
+
+    with report.stage('filter keywords'):
+        filter_rows = filter_keywords(rows.keywords)
+
+    with report.stage('tag questions'):
+        synonyms, qs = tag_questions(rows.questions, filter_rows, args.processes)
+
+    with report.stage('generate examples'):
+        new_qs = generate_examples(qs, synonyms, filter_rows, args.seed, args.processes)
+        log_synonyms_without_examples(qs + new_qs, filter_rows)
+        log_invalid_questions(qs)
+        log_generated_questions(new_qs)
+
+    with report.stage('emit filter questions'):
+        emit_filter_questions(artifacts, rows, filter_rows, qs + new_qs)
+
+    if args.sequential:
+        for name, emit, *emit_args in branches:
+            with report.stage(name):
+                emit(artifacts, *emit_args)
+    else:
+        # Merged in a fixed order, logs of the branches follow the logs of the filter questions
+        for future in futures:
+            branch_artifacts, stages, records = future.result()
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            artifacts.artifacts.update(branch_artifacts)
+            report.stages.update(stages)
+        pool.shutdown()
+
+    artifacts.save(sheets)
+    report.log()
+    return spreadsheet, report
+
+
+def fetch(args):
+    """Spreadsheet (None when importing offline) and the snapshot of its sheets"""
+    spreadsheet = None if args.offline else open_spreadsheet(args)
+    return spreadsheet, load_sheets(args, spreadsheet)
+
+
+def normalise(sheets):
+    return SheetRows(get_question_sheet(sheets), get_filter_keyword_sheet(sheets), get_phrases(sheets))
+
+
+def tag_questions(question_rows, filter_rows, processes=1):
+    synonyms = make_synonyms(filter_rows)
+    return synonyms, filter_questions_nlu_data(question_rows, synonyms, processes)
+
+
+def emit_questions_answers(artifacts, question_rows, contexts, main_intent):
+    nlu = questions_answers_nlu_data(contexts, question_rows, main_intent)
+    artifacts.write_yaml(f'data/generated/{main_intent}/nlu.yml', nlu,
+                         {SHEET_QUESTIONS: context_rows(question_rows, contexts)})
+
+
+def emit_phrases(artifacts, phrases):
+    nlu = phrase_utterances(phrases)
+    artifacts.write_yaml('data/generated/domain.yml', nlu,
+                         {SHEET_PHRASES: row_ranges(r for p in phrases for r in p.rows)})
+
+
+def emit_filter_questions(artifacts, rows, filter_rows, qs):
+    keyword_sources = {SHEET_FILTER_KEYWORDS: context_rows(rows.keywords, set(r.context for r in filter_rows))}
+
+    artifacts.write('data/generated/filter_questions/entities/filter_mapping.csv',
+                    filters_df(filter_rows).to_csv(index=False), keyword_sources)
+    artifacts.write('data/generated/filter_questions/entities/filter_synonyms.csv',
+                    synonyms_df(filter_rows).to_csv(index=False), keyword_sources)
+
+    # Precompiled lexicon loaded by the action server
+    artifacts.write('data/generated/filter_questions/entities/filter_lexicon.json',
+                    json.dumps(filter_lexicon(filter_rows), ensure_ascii=False), keyword_sources)
+
+    nlu = filters_nlu_data(filter_rows)
+    artifacts.write_yaml('data/generated/filter_questions/entities/nlu.yml', nlu, keyword_sources)
+
+    nlu = filter_questions_yaml(qs)
+    artifacts.write_yaml('data/generated/filter_questions/nlu.yml', nlu,
+                         dict(keyword_sources, **{SHEET_QUESTIONS: context_rows(rows.questions, FQ_CONTEXTS)}))
+
+
+def run_branch(output_dir, trace_memory, name, emit, *emit_args):
+    """Runs an emit stage in a worker process, returns its artifacts, timing and log records to the parent"""
+    records = []
+    sum_logger.handlers = logger.handlers = [RecordingHandler(records)]
+
+    artifacts = ArtifactWriter(output_dir)
+    report = TimingReport(trace_memory)
+    with report.stage(name):
+        emit(artifacts, *emit_args)
+    return artifacts.artifacts, report.stages, records
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TimingReport:
+    """Wall time and peak memory of the stages of the import
+
+    Memory is only traced with `trace_memory`, tracemalloc slows the import down. The peak of a stage is
+    the most memory allocated by Python during the stage on top of what was allocated before it.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            else:
+                # Before Python 3.9 the peak is only reset by restarting tracing
+                tracemalloc.stop()
+                tracemalloc.start()
+                base = 0
+
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - base if self.trace_memory else None
+        self.stages[name] = OrderedDict({'seconds': round(seconds, 3), 'peak_memory_mb': peak and round(peak / 2**20, 1)})
+
+    def log(self):
+        for name, stage in self.stages.items():
+            memory = f', peak memory {stage["peak_memory_mb"]} MB' if self.trace_memory else ''
+            logger.info(f'Timing, stage {name}: {stage["seconds"]}s{memory}')
+        sum_logger.info(f'Timing, import took {time.perf_counter() - self.start:.1f}s')
+
+    def save(self, path):
+        report = OrderedDict({'total_seconds': round(time.perf_counter() - self.start, 3), 'stages': self.stages})
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+
 def make_synonyms(filter_rows):
-    Synonym = namedtuple('Synonym', 'syn filter num_examples')
     synonyms = [Synonym(syn, row.filter, 0) for row in filter_rows for syn in [row.keyword] + row.synonyms]
     return synonyms
 
 
 
 def log_synonyms_without_examples(qs, filter_rows):
+    entities_with_examples = set(e for q in qs if q.is_valid for e in q.entities + q.auto_entities)
+    ctx_to_filter = defaultdict(list)
+    for f in filter_rows:
+        ctx_to_filter[f.context].append(f)
+
     contexts = set([f.context for f in filter_rows])
     for c in contexts:
-        fs = [f for f in filter_rows if f.context==c]
+        fs = ctx_to_filter[c]
 
-        filters_without_examples = []
-        for f in fs:
-            examples = [q for q in qs if q.is_valid and f.keyword in q.entities + q.auto_entities]
-            if not examples:
-                filters_without_examples.append(f.keyword)
+        filters_without_examples = [f.keyword for f in fs if f.keyword not in entities_with_examples]
 
         if filters_without_examples:
             sum_logger.info(f'Synonyms, context {c}, WARNING there are {len(filters_without_examples)} filters without examples')
@@ -176,10 +369,72 @@ def log_generated_questions(qs):
 
 
 
-def generate_examples(qs, synonyms, filter_rows):
+def quote_star(s):
+    return s.replace('*', r'\*')
+
+
+# Substitution patterns of the tags of synonyms, compiled once per synonym
+_tag_patterns = {}
+
+def replace_tag(syn, new_syn, question):
+    pattern = _tag_patterns.get(syn)
+    if pattern is None:
+        pattern = _tag_patterns[syn] = re.compile(f'\\[{quote_star(syn)}\\]')
+    return pattern.sub(f'[{new_syn}]', question)
+
+
+def generate_context_examples(context, synonyms, q_dict, syn_to_filter, ctx_to_filter, seed=None):
+    """Examples generated for the synonyms of a context without examples, as (synonym index, question) pairs"""
+
+    # Seeded per context, the examples of a context don't depend on the other contexts or on the order they are generated in
+    rng = random.Random(f'{seed}:{context}') if seed is not None else random.Random()
+
+    examples = []
+    for n, s in synonyms:
+        filter = syn_to_filter[s.syn]
+
+        syns = [filter.keyword] + filter.synonyms
+        rng.shuffle(syns)
+
+        example = None
+
+        for syn in syns:
+            if syn in q_dict:
+                q = rng.choice(q_dict[syn])
+                question = replace_tag(syn, s.syn, q.question)
+                example = (syn, q._replace(question=question))
+                break
+
+        # If still no examples, fallback to context
+        if filter.context in AUTO_GENERATE_FOR_CONTEXTS:
+            for f in ctx_to_filter[filter.context]:
+                for syn in [f.keyword] + f.synonyms:
+                    if syn in q_dict:
+                        q = rng.choice(q_dict[syn])
+                        question = replace_tag(syn, s.syn, q.question)
+                        example = (syn, q._replace(question=question, auto_entities=q.auto_entities+[s.syn]))
+                        break
+                if example:
+                    break
+
+        if example:
+            examples.append((n, example[1]))
 
-    def quote_star(s):
-        return s.replace('*', r'\*')
+    return examples
+
+
+# Data shared by the example generation processes, set once per process
+_generation = None
+
+def _init_generation(*generation):
+    global _generation
+    _generation = generation
+
+def _generate_context_examples(context, synonyms):
+    return generate_context_examples(context, synonyms, *_generation)
+
+
+def generate_examples(qs, synonyms, filter_rows, seed=None, processes=1):
 
     syn_to_filter = {s: f for f in filter_rows for s in [f.keyword] + f.synonyms}
     ctx_to_filter = defaultdict(list)
@@ -187,45 +442,30 @@ def generate_examples(qs, synonyms, filter_rows):
         ctx_to_filter[f.context] += [f]
 
     q_dict = defaultdict(list)
-    ctx_dict = {}
     for q in qs:
         if q.is_valid:
             for s in q.entities + q.auto_entities:
                 q_dict[s] += [q]
+    q_dict = dict(q_dict)
 
-    qs = []
-    generated = []
-    for s in synonyms:
-        filter = syn_to_filter[s.syn]
-
+    # Synonyms without examples, by context of their filter
+    ctx_synonyms = OrderedDict()
+    for n, s in enumerate(synonyms):
         if not s.syn in q_dict:
-            syns = [filter.keyword] + filter.synonyms
-            random.shuffle(syns)
-
-            example = None
+            ctx_synonyms.setdefault(syn_to_filter[s.syn].context, []).append((n, s))
 
-            for syn in syns:
-                if syn in q_dict:
-                    q = random.choice(q_dict[syn])
-                    question = re.sub(f'\[{quote_star(syn)}\]', f'[{s.syn}]', q.question)
-                    example = (syn, q._replace(question=question))
-                    break
-
-            # If still no examples, fallback to context
-            if filter.context in AUTO_GENERATE_FOR_CONTEXTS:
-                for f in ctx_to_filter[filter.context]:
-                    for syn in [f.keyword] + f.synonyms:
-                        if syn in q_dict:
-                            q = random.choice(q_dict[syn])
-                            question = re.sub(f'\[{quote_star(syn)}\]', f'[{s.syn}]', q.question)
-                            example = (syn, q._replace(question=question, auto_entities=q.auto_entities+[s.syn]))
-                            break
-                    if example:
-                        break
+    if processes > 1 and len(ctx_synonyms) > 1:
+        with multiprocessing.Pool(processes, initializer=_init_generation,
+                                  initargs=(q_dict, syn_to_filter, ctx_to_filter, seed)) as pool:
+            results = pool.starmap(_generate_context_examples, ctx_synonyms.items())
+    else:
+        results = [generate_context_examples(c, syns, q_dict, syn_to_filter, ctx_to_filter, seed)
+                   for c, syns in ctx_synonyms.items()]
 
-            if example:
-                qs.append(example[1])
-                generated.append((s, filter))
+    # Back in the order of the synonyms
+    examples = sorted((e for r in results for e in r), key=lambda e: e[0])
+    qs = [q for _, q in examples]
+    generated = [(synonyms[n], syn_to_filter[synonyms[n].syn]) for n, _ in examples]
 
     contexts = set([f.context for _, f in generated])
     for c in contexts:
@@ -236,6 +476,116 @@ def generate_examples(qs, synonyms, filter_rows):
     return qs
 
 
+class ArtifactWriter:
+    """Writes the generated files whose content changed and records the sheet rows they are generated from
+
+    Unchanged files are left untouched, so later steps can tell from their modification time or from the
+    changes summary that there is nothing to do. Files are replaced atomically.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.artifacts = OrderedDict()
+
+    @contextmanager
+    def open(self, path, sources):
+        """Text stream to write the file `path` to, the file is only replaced if its content changed"""
+        full_path = os.path.join(self.output_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp = f'{full_path}.tmp'
+
+        with open(tmp, 'wb') as f:
+            stream = HashingStream(f)
+            try:
+                yield stream
+            except BaseException:
+                f.close()
+                os.remove(tmp)
+                raise
+        digest = stream.hexdigest()
+
+        try:
+            with open(full_path, 'rb') as f:
+                changed = file_digest(f) != digest
+        except FileNotFoundError:
+            changed = True
+
+        if changed:
+            os.replace(tmp, full_path)
+        else:
+            os.remove(tmp)
+
+        self.artifacts[path] = OrderedDict({'sha256': digest, 'changed': changed, 'sources': sources})
+
+    def write(self, path, content, sources):
+        with self.open(path, sources) as f:
+            f.write(content)
+
+    def write_yaml(self, path, data, sources):
+        with self.open(path, sources) as f:
+            yaml_emitter.dump(data, f)
+
+    def save(self, spreadsheet):
+        """Writes the manifest and the changes summary next to the data directory"""
+        # Files are written by several processes, sorted to not depend on which one finished first
+        self.artifacts = OrderedDict(sorted(self.artifacts.items()))
+        changed = [path for path, a in self.artifacts.items() if a['changed']]
+        unchanged = [path for path, a in self.artifacts.items() if not a['changed']]
+        manifest = OrderedDict({
+            'spreadsheet': {'id': spreadsheet.id, 'revision': spreadsheet.revision},
+            'artifacts': OrderedDict((path, {'sha256': a['sha256'], 'sources': a['sources']})
+                                     for path, a in self.artifacts.items()),
+        })
+        changes = OrderedDict({
+            'changed': changed,
+            'unchanged': unchanged,
+        })
+        self.write(MANIFEST_FILE, json.dumps(manifest, indent=2, ensure_ascii=False) + '\n', {})
+        self.write(CHANGES_FILE, json.dumps(changes, indent=2) + '\n', {})
+        sum_logger.info(f'Generated files, {len(changed)} changed and {len(unchanged)} unchanged: {changed}')
+
+
+class HashingStream:
+    """Text stream writing UTF-8 to a binary file, hashing what is written"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, s):
+        data = s.encode('utf-8')
+        self.sha256.update(data)
+        self.f.write(data)
+        return len(s)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def file_digest(f, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def row_ranges(rows):
+    """Sheet row numbers as ranges of consecutive rows, e.g. ['2-40', '45']"""
+    ranges = []
+    for r in sorted(set(rows)):
+        if ranges and ranges[-1][1] == r - 1:
+            ranges[-1][1] = r
+        else:
+            ranges.append([r, r])
+    return [f'{first}-{last}' if first != last else str(first) for first, last in ranges]
+
+
+def context_rows(rows, contexts):
+    """Sheet rows of the given contexts"""
+    gs = group_by_column(rows, 'context')
+    return row_ranges(row.row for context in contexts if context in gs for row in gs[context])
+
+
 def save_logs_to_sheet(spreadsheet, sheetname, logs):
     worksheet = spreadsheet.worksheet(sheetname)
     lines = logs.split('\n')
@@ -249,8 +599,16 @@ def save_logs_to_sheet(spreadsheet, sheetname, logs):
 
 Question = namedtuple('Question', 'context intent question question_variants answers')
 
+# Raw rows of the question and phrases sheets
+QuestionRow = namedtuple('QuestionRow', 'context intent question question_variant answers row')
+Phrase = namedtuple('Phrase', 'key answers rows')
+
+# Rows of the filter keywords sheet and their keywords and synonyms
+FilterRow = namedtuple('FilterRow', 'context key filter keyword synonyms valid row')
+Synonym = namedtuple('Synonym', 'syn filter num_examples')
+
 
-def filter_keywords(args, filter_rows):
+def filter_keywords(filter_rows):
     gs = group_by_column(filter_rows, 'context')
 
     filters_with_key = [row._replace(key=rows[0].key, context=context, valid=rows[0].key and context)
@@ -258,10 +616,25 @@ def filter_keywords(args, filter_rows):
                         for row in rows[1:]
                         if row.keyword] # We remove cosmetic empty rows
 
+    # Inverted index from keywords and synonyms to the keywords of the valid filters using them
+    syn_keywords = defaultdict(set)
+    for of in filters_with_key:
+        if of.valid:
+            for syn in [of.keyword] + of.synonyms:
+                syn_keywords[syn].add(of.keyword)
+
+    def used_by_other_filter(syn, keyword):
+        keywords = syn_keywords.get(syn)
+        return bool(keywords) and (len(keywords) > 1 or keyword not in keywords)
+
+    ctx_to_filters = defaultdict(list)
+    for f in filters_with_key:
+        ctx_to_filters[f.context].append(f)
+
     # Logging
     contexts = set([f.context for f in filters_with_key])
     for c in contexts:
-        fs = [f for f in filters_with_key if f.context==c]
+        fs = ctx_to_filters[c]
         invalid = [f for f in fs if not f.valid]
 
         sum_logger.info(f'Synonyms, context {c}: Reading {len(fs)} synonyms')
@@ -269,18 +642,13 @@ def filter_keywords(args, filter_rows):
         logger.info(f'Synonyms, context {c}: Reading keyword and synonym variants: {all_syns}')
 
         overlapped_keywords = 0
-        # Expensive overlap check
         for f in fs:
             syns = [f.keyword] + f.synonyms
-            other_syns = [syn
-                          for of in filters_with_key if of.valid and of.keyword!=f.keyword
-                          for syn in [of.keyword] + of.synonyms]
-            overlap = [s for s in syns if s in other_syns]
+            overlap = [s for s in syns if used_by_other_filter(s, f.keyword)]
             if overlap:
                 logger.info(f'Synonyms, context {c}, keyword {f.keyword}, found conflicting synonyms: {overlap}, please solve the conflicts in the filter keywords sheet')
                 overlapped_keywords += 1
 
-
         if invalid:
             sum_logger.info(f'Synonyms, context {c}: WARNING discarding {len(invalid)} filter keywords')
             logger.info(f'Synonyms, context {c}: Discarding filter keywords {[f.keyword for f in invalid]} because of missing key or filter')
@@ -313,6 +681,16 @@ def synonyms_df(filter_rows):
         'filter': [f for _, f in syns],
     }).sort_values('filter')
 
+# Same content as filters_df and synonyms_df, in the format read by data/lexicon.py
+def filter_lexicon(filter_rows):
+    stemmer = SnowballStemmer('german')
+    rows = sorted(filter_rows, key=lambda r: r.filter)
+    return OrderedDict({
+        'version': 1,
+        'filters': OrderedDict((r.filter, [r.keyword, r.key, r.context, r.context=='_searchterms']) for r in rows),
+        'stems': OrderedDict((stemmer.stem(s), r.filter) for r in rows for s in [r.keyword] + r.synonyms),
+    })
+
 def filters_nlu_data(filter_rows):
     return OrderedDict({
         'version': '2.0',
@@ -368,30 +746,64 @@ def questions_answers_nlu_data(contexts, question_rows, main_intent):
 
 TaggedQuestion = namedtuple('TaggedQuestion', 'question entities auto_entities invalid_entities is_valid reason_invalid')
 
-def process_question(synonyms, question):
+
+class SynonymTagger:
+    """Finds the synonym to tag automatically in a question, in a single pass over the question
+
+    The tagged synonym is the longest one (the last in alphabetical order between equally long ones)
+    whose first occurrence in the question is followed by the end of the question or by one of ' .,?'.
+    Synonyms are indexed by their first two characters, the characters at each position of the
+    question give the lengths of the synonyms to look up, so the cost doesn't grow with the number
+    of synonyms.
+    """
+
+    def __init__(self, synonyms):
+        self.synonyms = frozenset(s for s in synonyms if s)
+        lengths = defaultdict(set)
+        for syn in self.synonyms:
+            lengths[syn[:2]].add(len(syn))
+        # Longer synonyms first
+        self._lengths = {prefix: sorted(ls, reverse=True) for prefix, ls in lengths.items()}
+
+    def match(self, question):
+        """Synonym to tag and its position in the question, None if there is none"""
+        best, best_position = None, None
+        seen = set()
+        n = len(question)
+        for i in range(n):
+            for prefix in {question[i:i+2], question[i]}:
+                for length in self._lengths.get(prefix, ()):
+                    if best is not None and length < len(best):
+                        break
+                    end = i + length
+                    syn = question[i:end]
+                    if end > n or syn in seen or syn not in self.synonyms:
+                        continue
+                    # Only the first occurrence of a synonym counts
+                    seen.add(syn)
+                    if (end >= n or question[end] in ' .,?') and (best is None or (length, syn) > (len(best), best)):
+                        best, best_position = syn, i
+        return (best, best_position) if best is not None else None
+
+
+def process_question(tagger, question):
     # Find all text marked by square braces
     tagged_entities = re.findall(r'\[[^\[]*\]', question)
     tagged_entities = [t[1:-1] for t in tagged_entities]
     tagged_entities = set(tagged_entities)
 
-    invalid_entities = list(tagged_entities - synonyms)
-
-    remaining_synonyms = list(synonyms - tagged_entities)
+    invalid_entities = list(tagged_entities - tagger.synonyms)
 
     new_entities = []
     tagged_entities = list(tagged_entities)
 
-    # Order remaining synonyms by larger to smaller to avoid accidental matches
-    remaining_synonyms = sorted([(len(s), s) for s in remaining_synonyms], reverse=True)
-    remaining_synonyms = [s[1] for s in remaining_synonyms]
-
-    for syn in remaining_synonyms:
-        if not [syn in s for s in new_entities + tagged_entities]:
-            # Make sure that analyzed new synonym is not a substring of an existing tag
-            i = question.find(syn)
-            if i>=0 and (i+len(syn) >= len(question) or question[i+len(syn)] in ' .,?'):
-                new_entities.append(syn)
-                question = question[:i] + '[' + syn + ']' + question[i+len(syn):]
+    # Only questions without any tag are tagged automatically, with a single synonym
+    if not tagged_entities:
+        match = tagger.match(question)
+        if match:
+            syn, i = match
+            new_entities.append(syn)
+            question = question[:i] + '[' + syn + ']' + question[i+len(syn):]
 
     if invalid_entities:
         reason_invalid = 'Invalid filter keywords found'
@@ -402,13 +814,31 @@ def process_question(synonyms, question):
 
     return TaggedQuestion(question, tagged_entities, new_entities, invalid_entities, not reason_invalid, reason_invalid)
 
-def filter_questions_nlu_data(question_rows, synonyms):
 
-    synonyms = set([s.syn for s in synonyms])
+# Tagger of the worker processes, set once per process rather than sent with every question
+_tagger = None
+
+def _init_tagger(tagger):
+    global _tagger
+    _tagger = tagger
+
+def _process_question(question):
+    return process_question(_tagger, question)
+
+def process_questions(tagger, questions, processes=1):
+    if processes > 1 and len(questions) > 1:
+        chunksize = max(1, len(questions) // (4 * processes))
+        with multiprocessing.Pool(processes, initializer=_init_tagger, initargs=(tagger,)) as pool:
+            return pool.map(_process_question, questions, chunksize=chunksize)
+    return [process_question(tagger, q) for q in questions]
+
+def filter_questions_nlu_data(question_rows, synonyms, processes=1):
+
+    tagger = SynonymTagger(s.syn for s in synonyms)
     gs = group_by_column(question_rows, 'context')
     content_questions = [row for context in FQ_CONTEXTS if context in gs for row in gs[context]]
 
-    qs = [process_question(synonyms, r.question_variant) for r in content_questions if r.question_variant]
+    qs = process_questions(tagger, [r.question_variant for r in content_questions if r.question_variant], processes)
 
     vqs = [q for q in qs if q.is_valid]
 
@@ -498,25 +928,113 @@ def open_spreadsheet(args):
     return spreadsheet
 
 
-def get_question_sheet(spreadsheet):
+class SnapshotWorksheet:
+    def __init__(self, values):
+        self.values = values
+
+    def get_all_values(self):
+        return fill_gaps(self.values) if self.values else []
+
+    # Same records as gspread's Worksheet.get_all_records, a sheet without rows below the header has none
+    def get_all_records(self, empty2zero=False, head=1, default_blank=""):
+        idx = head - 1
+        data = self.get_all_values()
+        if len(data) <= head:
+            return []
+        keys = data[idx]
+        values = [numericise_all(row, empty2zero, default_blank) for row in data[idx + 1:]]
+        return [dict(zip(keys, row)) for row in values]
+
+
+class SnapshotSpreadsheet:
+    """Stand-in of a gspread Spreadsheet with the values of its sheets, read from a snapshot
+
+    A snapshot is a JSON file {"spreadsheet_id": ..., "revision": ..., "sheets": {sheet name: rows of cell values}},
+    written by the import and usable as a fixture with hand written sheets.
+    """
+
+    def __init__(self, sheets, spreadsheet_id=None, revision=None):
+        self.sheets = sheets
+        self.id = spreadsheet_id
+        self.revision = revision
+
+    def worksheet(self, name):
+        if name not in self.sheets:
+            raise KeyError(f'Sheet {name} is not in the snapshot')
+        return SnapshotWorksheet(self.sheets[name])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        return cls(snapshot['sheets'], snapshot.get('spreadsheet_id'), snapshot.get('revision'))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'spreadsheet_id': self.id, 'revision': self.revision, 'sheets': self.sheets}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+def spreadsheet_revision(spreadsheet):
+    # The Drive version of a file increases with every change
+    res = spreadsheet.client.request('get', DRIVE_FILE_URL % spreadsheet.id, params={'fields': 'version'})
+    return res.json()['version']
+
+
+def fetch_sheets(spreadsheet, sheet_names):
+    """Values of all the sheets in a single batched request"""
+    ranges = ["'" + name.replace("'", "''") + "'" for name in sheet_names]
+    res = spreadsheet.client.request('get', SPREADSHEET_URL % spreadsheet.id + '/values:batchGet', params={'ranges': ranges})
+    value_ranges = res.json()['valueRanges']
+    return OrderedDict((name, r.get('values', [])) for name, r in zip(sheet_names, value_ranges))
 
-    # Raw rows of the question spreadsheet
-    Row = namedtuple('Row', 'context intent question question_variant answers')
+
+def snapshot_path(snapshot_dir, spreadsheet_id, revision):
+    return os.path.join(snapshot_dir, f'{spreadsheet_id}-{revision}.json')
+
+
+def load_sheets(args, spreadsheet):
+    """Snapshot of the sheets read by the import, fetched only if there is none of the current revision"""
+    if spreadsheet is None:
+        if args.snapshot:
+            path = args.snapshot
+        else:
+            paths = [os.path.join(args.snapshot_dir, p) for p in os.listdir(args.snapshot_dir) if p.endswith('.json')] \
+                if os.path.isdir(args.snapshot_dir) else []
+            if not paths:
+                raise FileNotFoundError(f'No spreadsheet snapshot in {args.snapshot_dir} to import offline')
+            path = max(paths, key=os.path.getmtime)
+        sum_logger.info(f'Reading spreadsheet snapshot {path}')
+        return SnapshotSpreadsheet.load(path)
+
+    revision = spreadsheet_revision(spreadsheet)
+    path = snapshot_path(args.snapshot_dir, spreadsheet.id, revision)
+    if os.path.exists(path):
+        sum_logger.info(f'Reading spreadsheet revision {revision} from snapshot {path}')
+        return SnapshotSpreadsheet.load(path)
+
+    snapshot = SnapshotSpreadsheet(fetch_sheets(spreadsheet, SHEETS), spreadsheet.id, revision)
+    snapshot.save(path)
+    sum_logger.info(f'Saved spreadsheet revision {revision} to snapshot {path}')
+    return snapshot
+
+
+def get_question_sheet(spreadsheet):
 
     sheet = spreadsheet.worksheet(SHEET_QUESTIONS)
     list_of_hashes = sheet.get_all_records()
 
-    rows = [Row(r[COL_CONTEXT], r[COL_INTENT], r[COL_EXAMPLE], r[COL_VARIANTS],
-                [r[col_answer] for col_answer in COL_ANSWERS if r[col_answer]])
-            for r in list_of_hashes]
+    # Row numbers in the sheet, after the header row
+    rows = [QuestionRow(r[COL_CONTEXT], r[COL_INTENT], r[COL_EXAMPLE], r[COL_VARIANTS],
+                [r[col_answer] for col_answer in COL_ANSWERS if r[col_answer]], n)
+            for n, r in enumerate(list_of_hashes, start=2)]
     return rows
 
 
 def get_filter_keyword_sheet(spreadsheet):
 
-    # Raw rows of the question spreadsheet
-    Row = namedtuple('Row', 'context key filter keyword synonyms valid')
-
     sheet = spreadsheet.worksheet(SHEET_FILTER_KEYWORDS)
     list_of_hashes = sheet.get_all_records()
 
@@ -530,29 +1048,26 @@ def get_filter_keyword_sheet(spreadsheet):
     def clean(s):
         return s.strip().replace('[','').replace(']','')
 
-    rows = [Row(r[COL_FILTER_CONTEXT], clean(r[COL_KEY]), clean(r[COL_FILTER]), clean(r[COL_KEYWORD]),
-                [clean(syn(r, i)) for i in range(1, NUM_SYNONYMS) if clean(syn(r, i))], True)
-            for r in list_of_hashes]
+    rows = [FilterRow(r[COL_FILTER_CONTEXT], clean(r[COL_KEY]), clean(r[COL_FILTER]), clean(r[COL_KEYWORD]),
+                [clean(syn(r, i)) for i in range(1, NUM_SYNONYMS) if clean(syn(r, i))], True, n)
+            for n, r in enumerate(list_of_hashes, start=2)]
     return rows
 
 
 def get_phrases(spreadsheet):
 
-    # Raw rows of the question spreadsheet
-    Phrase = namedtuple('Phrase', 'key answers')
-
     sheet = spreadsheet.worksheet(SHEET_PHRASES)
     list_of_hashes = sheet.get_all_records()
 
     phrases = [Phrase(r[COL_PHRASE_KEY],
-                [r[col_answer].strip() for col_answer in COL_PHRASE_ANSWERS if r[col_answer].strip()])
-            for r in list_of_hashes]
+                [r[col_answer].strip() for col_answer in COL_PHRASE_ANSWERS if r[col_answer].strip()], [n])
+            for n, r in enumerate(list_of_hashes, start=2)]
 
     # Post process to group variants per key
     # There is a change of type in answers where there is a list of lists
     # The outer list represent the variants, the inner list represents the bubbles (multiple subsequent answers)
     gs = group_by_column(phrases, 'key')
-    phrases = [Phrase(key[1:], [phrase.answers for phrase in phrases if phrase.answers])
+    phrases = [Phrase(key[1:], [phrase.answers for phrase in phrases if phrase.answers], [n for phrase in phrases for n in phrase.rows])
         for key, phrases in gs.items()
         if key[0]=='/'
     ]
@@ -562,22 +1077,5 @@ def get_phrases(spreadsheet):
     return phrases
 
 
-#################
-# YAML rendering setup
-#################
-
-def str_presenter(dumper, data):
-    if len(data.splitlines()) > 1:  # check for multiline string
-        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
-    return dumper.represent_scalar('tag:yaml.org,2002:str', data)
-
-def ordered_dict_presenter(dumper, data):
-    return dumper.represent_dict(data.items())
-yaml.add_representer(OrderedDict, ordered_dict_presenter)
-yaml.add_representer(str, str_presenter)
-
-
-# Run the main function
-main()
-
-
+if __name__ == '__main__':
+    main()
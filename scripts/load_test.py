@@ -0,0 +1,226 @@
+"""Load test of the action server against a local stand-in of the Beratungsnetz API
+
+The script starts a stub of the `/actions/exportItems` endpoint, optionally starts the action server
+pointing at it, and sends `action_filter_results` webhook requests at a target concurrency. Filters are
+sampled from the filter mapping and synonyms of the conversation data, as the NLU would extract them.
+
+Run from the repository root, e.g.:
+
+    python3 scripts/load_test.py --start-server --concurrency 50 --requests 5000 --stub-latency 0.2
+
+With `--workers N` the started action server runs N worker processes (`scripts/run_action_server.py`).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+FILTER_MAPPING_PATH = 'data/generated/filter_questions/entities/filter_mapping.csv'
+FILTER_SYNONYMS_PATH = 'data/generated/filter_questions/entities/filter_synonyms.csv'
+
+# Entities which are not filters, to exercise the unresolved entity path
+UNKNOWN_ENTITIES = ['Bahnhof', 'Fahrrad', 'Wetter', 'Urlaub']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Load test the action server with a local Beratungsnetz API stub')
+    parser.add_argument('--action-server-url', type=str, default='http://localhost:5055/webhook')
+    parser.add_argument('--start-server', action='store_true', help='Start the action server pointing at the stub')
+    parser.add_argument('--workers', type=int, help='Start the action server with this number of worker processes')
+    parser.add_argument('--shared-cache', action='store_true', help='Share the result counts between the workers of the started server')
+    parser.add_argument('--concurrency', type=int, default=20, help='Number of conversations sending requests at once')
+    parser.add_argument('--requests', type=int, default=2000, help='Total number of webhook requests')
+    parser.add_argument('--max-filters', type=int, default=3, help='Maximum number of filter entities per request')
+    parser.add_argument('--unknown-rate', type=float, default=0.05, help='Share of entities which are not filters')
+    parser.add_argument('--stub-port', type=int, default=8099)
+    parser.add_argument('--stub-latency', type=float, default=0.1, help='Mean latency of the stub in seconds')
+    parser.add_argument('--stub-items', type=int, default=500, help='Maximum number of items returned by the stub')
+    parser.add_argument('--stub-error-rate', type=float, default=0.0, help='Share of stub responses with status 500')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, help='Save the report as JSON')
+    return parser.parse_args()
+
+
+########################################
+# Beratungsnetz API stub
+########################################
+
+async def start_stub(args, stats):
+    rng = random.Random(args.seed)
+
+    async def export_items(request):
+        stats['stub_requests'] += 1
+        await asyncio.sleep(rng.expovariate(1 / args.stub_latency) if args.stub_latency else 0)
+        if rng.random() < args.stub_error_rate:
+            raise web.HTTPInternalServerError()
+        # Larger responses for requests with fewer filters
+        tags = request.query.get('tags') or request.query.get('tag') or ''
+        num_filters = len([t for t in tags.split(',') if t]) + ('search' in request.query)
+        num_items = rng.randint(0, args.stub_items // max(1, num_filters))
+        return web.json_response([{'id': i} for i in range(num_items)])
+
+    app = web.Application()
+    app.router.add_get('/actions/exportItems', export_items)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.stub_port).start()
+    return runner
+
+
+########################################
+# Webhook payloads
+########################################
+
+def read_entities():
+    with open(FILTER_MAPPING_PATH, newline='') as f:
+        filters = [r['filter'] for r in csv.DictReader(f)]
+    with open(FILTER_SYNONYMS_PATH, newline='') as f:
+        synonyms = [r['synonym'] for r in csv.DictReader(f)]
+    return filters, synonyms
+
+
+def webhook_payload(rng, args, filters, synonyms, n):
+    entities = []
+    for _ in range(rng.randint(1, args.max_filters)):
+        r = rng.random()
+        if r < args.unknown_rate:
+            value = rng.choice(UNKNOWN_ENTITIES)
+        elif r < 0.5:
+            # Synonym resolved by the NLU
+            value = rng.choice(filters)
+        else:
+            # Left for the action server to resolve through the stem
+            value = rng.choice(synonyms)
+        entities.append({'entity': 'filter', 'value': value})
+
+    sender_id = f'load-test-{n}'
+    return {
+        'next_action': 'action_filter_results',
+        'sender_id': sender_id,
+        'version': '2.1.2',
+        'domain': {},
+        'tracker': {
+            'sender_id': sender_id,
+            'slots': {'action_filter_error': None},
+            'latest_message': {'text': ' '.join(e['value'] for e in entities),
+                               'intent': {'name': 'filter_question', 'confidence': 1.0},
+                               'entities': entities},
+            'latest_event_time': time.time(),
+            'latest_action_name': 'action_listen',
+            'followup_action': None,
+            'paused': False,
+            'events': [],
+            'latest_input_channel': None,
+            'active_loop': {},
+        },
+    }
+
+
+########################################
+# Driver
+########################################
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+async def drive(args, stats):
+    rng = random.Random(args.seed)
+    filters, synonyms = read_entities()
+    payloads = [webhook_payload(rng, args, filters, synonyms, n) for n in range(args.requests)]
+    latencies = []
+    errors = 0
+    queue = iter(payloads)
+
+    async def conversation(session):
+        nonlocal errors
+        for payload in queue:
+            start = time.perf_counter()
+            try:
+                async with session.post(args.action_server_url, json=payload) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = TCPConnector(limit=args.concurrency)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=60)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[conversation(session) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'workers': args.workers or 1,
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': args.concurrency,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'stub_requests': stats['stub_requests'],
+    }
+
+
+def start_action_server(args):
+    env = dict(os.environ, BFZ_API_URL=f'http://127.0.0.1:{args.stub_port}')
+    port = str(urlparse(args.action_server_url).port)
+    if args.workers:
+        cmd = [sys.executable, 'scripts/run_action_server.py', '--workers', str(args.workers), '--port', port]
+        cmd += ['--shared-cache'] if args.shared_cache else []
+    else:
+        cmd = [sys.executable, '-m', 'rasa_sdk', '--actions', 'data', '--port', port]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for_server(url, timeout=60):
+    health = url.rsplit('/', 1)[0] + '/health'
+    deadline = time.time() + timeout
+    async with ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(health) as resp:
+                    if resp.status == 200:
+                        return
+            except Exception:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f'Action server at {url} did not start')
+
+
+async def main(args):
+    stats = {'stub_requests': 0}
+    stub = await start_stub(args, stats)
+    server = start_action_server(args) if args.start_server else None
+    try:
+        await wait_for_server(args.action_server_url)
+        report = await drive(args, stats)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        await stub.cleanup()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    asyncio.run(main(get_args()))
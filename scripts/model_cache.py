@@ -0,0 +1,134 @@
+"""Models named after a fingerprint of what they are trained from
+
+The fingerprint hashes the NLU and policy configuration, the training data and domain in `data`, the
+custom components referenced by the configuration (e.g. `fallback.py`) and the Rasa version. A model is
+trained with `--fixed-model-name` set to the fingerprint, so the model of the current content is found by
+name: training is skipped when it already exists, and uploads and publications pick exactly that model
+rather than the most recent file in `models`.
+
+Run from the repository root:
+
+    python3 scripts/model_cache.py train    # train unless the model of the current content exists
+    python3 scripts/model_cache.py path     # path of the model of the current content
+    python3 scripts/model_cache.py name     # name of the model of the current content
+"""
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+
+import yaml
+
+CONFIG_PATH = 'config.yml'
+DATA_DIR = 'data'
+MODELS_DIR = 'models'
+
+# Files of the data directory read by `rasa train`, the Python modules there are the action server
+TRAINING_DATA_EXTENSIONS = ('.yml', '.yaml', '.md', '.json')
+
+# Custom components and policies which are not referenced by the configuration
+EXTENSION_MODULES = ['fallback.py']
+
+MODEL_PREFIX = 'model-'
+FINGERPRINT_LENGTH = 16
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Train models named after the fingerprint of their inputs and find them')
+    parser.add_argument('command', choices=['train', 'path', 'name', 'fingerprint'], nargs='?', default='train')
+    parser.add_argument('--config', type=str, default=CONFIG_PATH)
+    parser.add_argument('--data', type=str, default=DATA_DIR)
+    parser.add_argument('--models', type=str, default=MODELS_DIR)
+    parser.add_argument('--force', action='store_true', help='Train even if the model of the current content exists')
+    return parser.parse_args()
+
+
+def training_files(data_dir):
+    files = []
+    for root, dirs, names in os.walk(data_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
+        files += [os.path.join(root, name) for name in names if name.endswith(TRAINING_DATA_EXTENSIONS)]
+    return sorted(files)
+
+
+def extension_modules(config_path):
+    """Source files of the custom components and policies of the configuration, e.g. `fallback.py`"""
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+    names = [c['name'] for key in ['pipeline', 'policies'] for c in config.get(key) or [] if '.' in c.get('name', '')]
+
+    modules = set(EXTENSION_MODULES)
+    for name in names:
+        module = name.rsplit('.', 1)[0].replace('.', os.sep)
+        for path in [module + '.py', os.path.join(module, '__init__.py')]:
+            if os.path.exists(path):
+                modules.add(path)
+    return sorted(m for m in modules if os.path.exists(m))
+
+
+def rasa_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('rasa').version
+    except Exception:
+        return None
+
+
+def fingerprint(config_path=CONFIG_PATH, data_dir=DATA_DIR):
+    """Hash of the paths and contents of the files a model is trained from"""
+    sha256 = hashlib.sha256()
+    sha256.update(f'rasa {rasa_version()}\n'.encode('utf-8'))
+    for path in [config_path] + training_files(data_dir) + extension_modules(config_path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        sha256.update(f'{path.replace(os.sep, "/")} {len(content)}\n'.encode('utf-8'))
+        sha256.update(content)
+    return sha256.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def model_name(fp):
+    return MODEL_PREFIX + fp
+
+
+def model_path(models_dir, fp):
+    return os.path.join(models_dir, model_name(fp) + '.tar.gz')
+
+
+def train(args, fp):
+    path = model_path(args.models, fp)
+    if os.path.exists(path) and not args.force:
+        print(f'Model {path} of the current content exists, not training', file=sys.stderr)
+        return path
+
+    command = ['rasa', 'train', '--config', args.config, '--domain', args.data, '--data', args.data,
+               '--out', args.models, '--fixed-model-name', model_name(fp)]
+    subprocess.run(command, check=True)
+    # Rasa writes no model when its own fingerprint, which leaves out the code of custom components, is the
+    # same as the latest model's. Training is forced then, as the model of the current content is missing.
+    if not os.path.exists(path):
+        subprocess.run(command + ['--force'], check=True)
+    if not os.path.exists(path):
+        sys.exit(f'Training did not write {path}')
+    return path
+
+
+def main():
+    args = get_args()
+    fp = fingerprint(args.config, args.data)
+
+    if args.command == 'fingerprint':
+        print(fp)
+    elif args.command == 'name':
+        print(model_name(fp))
+    elif args.command == 'path':
+        path = model_path(args.models, fp)
+        if not os.path.exists(path):
+            sys.exit(f'No model {path} of the current content, run `make train-model` first')
+        print(path)
+    else:
+        print(train(args, fp))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Action server with several worker processes behind one port
+
+`rasa run actions` serves from a single process, one event loop on one core. This script opens the
+listening socket once and forks `--workers` processes serving it, each one an action server created with
+`rasa_sdk.endpoint.create_app`. Workers which exit are restarted.
+
+The workers share:
+ * the filter lexicon, written once as a memory mapped file (see `data.lexicon.MappedFilterLexicon`)
+   rather than loaded by every worker,
+ * with `--shared-cache`, the result counts fetched from the Beratungsnetz API, in an SQLite database
+   in local shared memory (see `data.result_cache.SharedCountStore`).
+
+Every worker serves its metrics on its own port, `METRICS_PORT` + the number of the worker.
+
+Run from the repository root:
+
+    python3 scripts/run_action_server.py --workers 4 --shared-cache
+    python3 scripts/run_action_server.py --check-shared-cache    # check that forked workers share counts
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from multiprocessing.connection import wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from data.lexicon import load_lexicon, write_mapped_lexicon
+from data.result_cache import SharedCountStore, result_cache
+
+logger = logging.getLogger(__name__)
+
+# Local shared memory, files there never hit the disk
+SHARED_MEMORY_DIR = '/dev/shm'
+# Seconds before restarting a worker which exited, so that a worker failing on start doesn't spin
+RESTART_DELAY = 1.0
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Run the action server with several worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--actions', type=str, default='data', help='Package of the actions')
+    parser.add_argument('--shared-cache', action='store_true', help='Share the result counts between the workers')
+    parser.add_argument('--check-shared-cache', action='store_true',
+                        help='Check that a count stored by one worker is served to another one, then exit')
+    return parser.parse_args()
+
+
+def shared_path(name):
+    directory = SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else tempfile.gettempdir()
+    return os.path.join(directory, f'miki-{os.getpid()}-{name}')
+
+
+def listen(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def attach_shared_cache(path):
+    """Backs the result cache of this worker with the database at `path`
+
+    The master imports the cache before the database exists, the workers inherit it without a shared store.
+    """
+    result_cache.shared = SharedCountStore(path)
+
+
+async def close_bfz_client(app, loop):
+    from data.bfz_client import bfz_client
+
+    await bfz_client.close()
+
+
+def serve(number, sock, actions, cache_path):
+    """Runs worker `number` on the listening socket `sock`, in a forked process"""
+    # Handlers of the master process, Sanic installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    if cache_path:
+        attach_shared_cache(cache_path)
+
+    # The actions and their metrics are only imported in the workers, after the port is set
+    metrics_port = int(os.environ.get('METRICS_PORT', 5056))
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + number)
+
+    from rasa_sdk.endpoint import create_app
+
+    app = create_app(actions)
+    # The pooled API session belongs to the loop of the server, Sanic closes the loop after these listeners
+    app.register_listener(close_bfz_client, 'after_server_stop')
+    app.run(sock=sock, workers=1, access_log=False)
+
+
+def run(args):
+    sock = listen(args.port)
+
+    lexicon_path = shared_path('filter-lexicon.bin')
+    write_mapped_lexicon(load_lexicon(), lexicon_path)
+    os.environ['FILTER_LEXICON_MMAP_PATH'] = lexicon_path
+
+    cache_path = shared_path('result-cache.sqlite') if args.shared_cache else None
+    if cache_path:
+        # Created before forking, so that the workers don't all set up the database at once on their first request
+        SharedCountStore(cache_path).create()
+
+    context = multiprocessing.get_context('fork')
+    workers = {}
+    stopping = False
+
+    def start(number):
+        process = context.Process(target=serve, args=(number, sock, args.actions, cache_path), name=f'action-worker-{number}')
+        process.start()
+        workers[process.sentinel] = (number, process)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for _, process in workers.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for number in range(args.workers):
+        start(number)
+    logger.info(f'Action server is up and running on port {args.port} with {args.workers} workers')
+
+    try:
+        while workers:
+            for sentinel in wait(list(workers)):
+                number, process = workers.pop(sentinel)
+                process.join()
+                if not stopping:
+                    logger.warning(f'Worker {number} exited with code {process.exitcode}, restarting it')
+                    time.sleep(RESTART_DELAY)
+                    start(number)
+    finally:
+        sock.close()
+        for path in [lexicon_path] + ([cache_path, f'{cache_path}-wal', f'{cache_path}-shm'] if cache_path else []):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _check_worker(number, cache_path, conn):
+    attach_shared_cache(cache_path)
+
+    async def fetch():
+        return number
+
+    value = asyncio.get_event_loop().run_until_complete(result_cache.get_or_fetch(('check-shared-cache',), fetch))
+    conn.send((value, result_cache.shared_hits))
+
+
+def check_shared_cache():
+    """Forks two workers as `run` does, one after the other, the second must be served the count of the first"""
+    cache_path = shared_path('check-result-cache.sqlite')
+    SharedCountStore(cache_path).create()
+    context = multiprocessing.get_context('fork')
+    try:
+        served = []
+        for number in range(2):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_check_worker, args=(number, cache_path, sender))
+            process.start()
+            sender.close()
+            try:
+                served.append(receiver.recv())
+            except EOFError:
+                process.join()
+                sys.exit(f'Worker {number} of the check failed with exit code {process.exitcode}')
+            process.join()
+    finally:
+        for path in [cache_path, f'{cache_path}-wal', f'{cache_path}-shm']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    (_, _), (value, shared_hits) = served
+    if value != 0 or shared_hits != 1:
+        sys.exit(f'The second worker was not served the count of the first one: count {value}, {shared_hits} shared hits')
+    logger.info('The count stored by a worker was served to another one')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = get_args()
+    if args.check_shared_cache:
+        check_shared_cache()
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
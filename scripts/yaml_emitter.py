@@ -0,0 +1,54 @@
+"""YAML rendering of the files generated by the importer
+
+Documents are written straight to a stream with libyaml's emitter when PyYAML is built with it, falling
+back to the pure Python emitter otherwise. The output is the same with both emitters, documents with
+strings they would write differently are always written by the pure Python emitter.
+"""
+import re
+from collections import OrderedDict
+
+import yaml
+
+# Line breaks as recognised by str.splitlines, followed by more text
+MULTILINE = re.compile('(?:\r\n|\r(?!\n)|[\n\v\f\x1c\x1d\x1e\x85\u2028\u2029])(?=.)', re.DOTALL)
+
+# Strings libyaml writes differently from PyYAML: characters it escapes (control characters, characters
+# outside the BMP, line breaks other than \n) and multiline strings which can't be written as literal
+# blocks, written double quoted and folded differently
+C_EMITTER_UNSAFE = re.compile('[^\n\x20-\x7e\xa0-\u2027\u202a-\ud7ff\ue000-\ufefe\uff00-\ufffd]| \n| \\Z')
+# Keys which are not written as simple keys
+C_EMITTER_MAX_KEY = 120
+
+
+def str_presenter(dumper, data):
+    if MULTILINE.search(data):  # check for multiline string
+        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_scalar('tag:yaml.org,2002:str', data)
+
+
+def ordered_dict_presenter(dumper, data):
+    return dumper.represent_dict(data.items())
+
+
+CDumper = getattr(yaml, 'CDumper', None)
+
+for dumper in [yaml.Dumper] + ([CDumper] if CDumper else []):
+    yaml.add_representer(OrderedDict, ordered_dict_presenter, Dumper=dumper)
+    yaml.add_representer(str, str_presenter, Dumper=dumper)
+
+
+def c_emitter_safe(data, key=False):
+    """Whether libyaml's emitter writes `data` the same as the pure Python emitter"""
+    if isinstance(data, str):
+        return not (C_EMITTER_UNSAFE.search(data) or key and (len(data) >= C_EMITTER_MAX_KEY or '\n' in data))
+    if isinstance(data, dict):
+        return all(c_emitter_safe(k, True) and c_emitter_safe(v) for k, v in data.items())
+    if isinstance(data, (list, tuple)):
+        return all(c_emitter_safe(v) for v in data)
+    return True
+
+
+def dump(data, stream):
+    """Writes `data` to the text stream `stream`"""
+    dumper = CDumper if CDumper and c_emitter_safe(data) else yaml.Dumper
+    yaml.dump(data, stream, Dumper=dumper, allow_unicode=True)